@@ -1,8 +1,14 @@
 """test auxilary functions"""
 
+import os
 import numpy as np
 from pytest import approx
+from wannierberri.__utility import FortranFileR, FortranFileMmap
 from wannierberri.formula.covariant import _spin_velocity_einsum_opt
+from wannierberri.system.system import pauli_xyz, spin_operator
+from wannierberri.system.w90_files import (load_npz, NPZ_MMAP_MIN_BYTES, einsum_kpool, map_kpool,
+                                           hermitize_inplace, get_zero_buffer, release_buffer, clear_buffer_pool)
+from common import ROOT_DIR
 
 
 def test_spin_velocity_einsum_opt():
@@ -18,3 +24,98 @@ def test_spin_velocity_einsum_opt():
         # Optimized version of C += np.einsum('knls,klma->knmas', A, B). Used in shc_B_H.
         C1 += np.einsum('knls,klma->knmas', A, B)
         assert C1 == approx(C)
+
+
+def test_spin_operator():
+    nw = 3
+    spin = spin_operator(nw)
+    assert spin.shape == (2 * nw, 2 * nw, 3)
+    assert spin.flags['C_CONTIGUOUS'] and not spin.flags['WRITEABLE']
+    for i in range(nw):
+        assert spin[2 * i:2 * i + 2, 2 * i:2 * i + 2] == approx(pauli_xyz)
+    assert np.einsum('ija->', abs(spin)) == approx(nw * np.einsum('ija->', abs(pauli_xyz)))
+
+
+def test_fortran_file_mmap():
+    """check that the memory-mapped reader gives the same records as fortio"""
+    filename = os.path.join(ROOT_DIR, "data", "Fe_Wannier90", "Fe.chk")
+    f_fortio = FortranFileR(filename)
+    f_mmap = FortranFileMmap(filename)
+    for _ in range(len(f_mmap._offsets) - 2):
+        assert np.array_equal(f_mmap.read_record('u1'), f_fortio.read_record('u1'))
+    assert f_mmap.skip_record() == f_fortio.skip_record()
+    assert np.array_equal(f_mmap.read_record('u1'), f_fortio.read_record('u1'))
+
+
+def test_fortran_file_mmap_read_records():
+    """check reading many records of the same length at once"""
+    filename = os.path.join(ROOT_DIR, "data", "Fe_Wannier90", "Fe.uHu")
+    f_fortio = FortranFileR(filename)
+    f_mmap = FortranFileMmap(filename)
+    f_mmap.skip_record(2)
+    f_fortio.skip_record(2)
+    nrec = len(f_mmap._offsets) - 2
+    records = f_mmap.read_records('f8', nrec)
+    assert records.shape[0] == nrec
+    for rec in records:
+        assert np.array_equal(rec, f_fortio.read_record('f8'))
+
+
+def test_load_npz_mmap(tmp_path):
+    """check that the large uncompressed members of an npz file are memory-mapped"""
+    rng = np.random.default_rng(0)
+    arrays = dict(data=rng.random((NPZ_MMAP_MIN_BYTES // 16 + 1, 2)) * (1 + 1j),
+                  dataF=np.asfortranarray(rng.random((3, NPZ_MMAP_MIN_BYTES // 8))),
+                  G=np.arange(10))
+    fn = str(tmp_path / "stored.npz")
+    fn_compressed = str(tmp_path / "compressed.npz")
+    np.savez(fn, **arrays)
+    np.savez_compressed(fn_compressed, **arrays)
+    for f, mmapped in (fn, {"data", "dataF"}), (fn_compressed, set()):
+        dic = load_npz(f, list(arrays), mmap_mode='r')
+        for k, a in arrays.items():
+            assert isinstance(dic[k], np.memmap) == (k in mmapped)
+            assert np.array_equal(dic[k], a)
+
+
+def test_einsum_kpool():
+    rng = np.random.default_rng(0)
+    a = rng.random((7, 3, 4)) + 1j * rng.random((7, 3, 4))
+    b = rng.random((7, 4, 5, 3))
+    c = rng.random((7, 5))
+    ref = np.einsum("kij,kjla,kl->kila", a, b, c)
+    for npar_k in 1, 2, 3, 10:
+        assert einsum_kpool("kij,kjla,kl->kila", a, b, c, npar_k=npar_k) == approx(ref)
+
+
+def test_map_kpool():
+    a = np.random.default_rng(0).random((7, 3, 4))
+    for npar_k in 1, 2, 3, 10:
+        b = np.zeros((7, 4, 3))
+
+        def fill(sl):
+            b[sl] = a[sl].transpose(0, 2, 1)
+        map_kpool(fill, 7, npar_k=npar_k)
+        assert np.array_equal(b, a.transpose(0, 2, 1))
+
+
+def test_hermitize_inplace():
+    rng = np.random.default_rng(0)
+    a = rng.random((3, 4, 4, 3)) + 1j * rng.random((3, 4, 4, 3))
+    ref = 0.5 * (a + a.transpose(0, 2, 1, 3).conj())
+    b = a.copy()
+    assert hermitize_inplace(b) is b
+    assert b == approx(ref)
+
+
+def test_buffer_pool():
+    a = get_zero_buffer((2, 3, 4))
+    a[:] = 1
+    release_buffer(a)
+    b = get_zero_buffer((6, 4))
+    assert np.shares_memory(a, b)
+    assert b.shape == (6, 4)
+    assert np.all(b == 0)
+    release_buffer(b)
+    clear_buffer_pool()
+    assert not np.shares_memory(get_zero_buffer((6, 4)), b)
@@ -1,10 +1,12 @@
 """Test the Data_K object."""
 
 import numpy as np
+import pytest
 from pytest import approx
 import wannierberri as wberri
 from wannierberri.grid.__Kpoint import KpointBZparallel
 from wannierberri.data_K import get_data_k
+from wannierberri.__utility import FFT_R_to_k
 
 
 def test_fourier(system_Fe_W90):
@@ -45,3 +47,86 @@ def test_fourier(system_Fe_W90):
                 f"numpy does not match fftw for {field}_bar_der{der} "
 
     # TODO: Allow gauge degree of freedom
+
+
+@pytest.mark.parametrize("method", ["numba", "einsum", "tensordot"])
+def test_fourier_R_to_k(system_Fe_W90, method, monkeypatch):
+    """Compare the Fourier transform at arbitrary k-points with FFT."""
+    if method != "numba":
+        monkeypatch.setattr(wberri.system.system, "FOURIER_NUMBA_MAX_NUM_WANN", 0)
+    if method == "tensordot":
+        monkeypatch.setattr(wberri.system.system, "FOURIER_TENSORDOT_THRESHOLD", 0)
+    system = system_Fe_W90
+    NKFFT = (4, 3, 2)
+    kpoints = np.array([(i, j, l) for i in range(NKFFT[0]) for j in range(NKFFT[1]) for l in range(NKFFT[2])]
+                       ) / np.array(NKFFT)
+    fft = FFT_R_to_k(system.iRvec, NKFFT, system.num_wann, fftlib='numpy')
+    for key in 'Ham', 'AA', 'SS', 'SA':
+        X_R = system.get_R_mat(key)
+        assert system.fourier_R_to_k(X_R, kpoints, key=key) == approx(fft(X_R)), \
+            f"fourier_R_to_k does not match FFT for {key}"
+
+
+def test_fourier_on_grid(system_Fe_W90):
+    """Compare the Fourier transform on a grid with the transform at the grid k-points."""
+    system = system_Fe_W90
+    NKFFT = (3, 2, 4)
+    kpoints = np.array([(i, j, l) for i in range(NKFFT[0]) for j in range(NKFFT[1]) for l in range(NKFFT[2])]
+                       ) / np.array(NKFFT)
+    for key in 'Ham', 'AA', 'SA':
+        X_R = system.get_R_mat(key)
+        assert system.fourier_on_grid(X_R, NKFFT) == approx(system.fourier_R_to_k(X_R, kpoints, key=key)), \
+            f"fourier_on_grid does not match fourier_R_to_k for {key}"
+
+
+@pytest.mark.parametrize("method", ["numba", "einsum"])
+def test_fourier_R_to_k_complex64(system_Fe_W90, method, monkeypatch):
+    """Check the Fourier transform in single precision."""
+    if method != "numba":
+        monkeypatch.setattr(wberri.system.system, "FOURIER_NUMBA_MAX_NUM_WANN", 0)
+    system = system_Fe_W90
+    kpoints = np.random.random((5, 3))
+    X_R = system.get_R_mat('AA')
+    X_K = system.fourier_R_to_k(X_R, kpoints, key='AA')
+    monkeypatch.setattr(system, "dtype", np.dtype(np.complex64))
+    X_K_32 = system.fourier_R_to_k(X_R, kpoints, key='AA')
+    assert X_K_32.dtype == np.complex64
+    assert X_K_32 == approx(X_K, abs=1e-5 * abs(X_K).max())
+
+
+def test_fourier_R_to_k_mmap(system_Fe_W90, tmp_path, monkeypatch):
+    """Check the Fourier transform of a memory-mapped matrix, read by chunks of R-vectors."""
+    monkeypatch.setattr(wberri.system.system, "FOURIER_R_CHUNK", 7)
+    system = system_Fe_W90
+    kpoints = np.random.random((5, 3))
+    X_R = system.get_R_mat('AA')
+    np.save(tmp_path / "AA_R.npy", X_R)
+    X_R_mmap = np.load(tmp_path / "AA_R.npy", mmap_mode='r')
+    assert system.fourier_R_to_k(X_R_mmap, kpoints, key='AA') == approx(system.fourier_R_to_k(X_R, kpoints, key='AA'))
+
+
+@pytest.mark.parametrize("fftlib", ["fftw", "numpy", "slow"])
+def test_data_k_complex64(system_Fe_W90, fftlib, monkeypatch):
+    """Check that the dtype of the system is used by the FFT in Data_K."""
+    system = system_Fe_W90
+    grid = wberri.Grid(system, NKFFT=[4, 3, 2], NKdiv=1, use_symmetry=False)
+    k = np.array([0.1, 0.2, -0.3])
+    kpoint = KpointBZparallel(K=k, dK=1. / grid.div, NKFFT=grid.FFT, factor=1., symgroup=None)
+    data = get_data_k(system, kpoint.Kp_fullBZ, grid=grid, Kpoint=kpoint, npar_k=0, fftlib=fftlib)
+    HH_K = data.HH_K
+    monkeypatch.setattr(system, "dtype", np.dtype(np.complex64))
+    data_32 = get_data_k(system, kpoint.Kp_fullBZ, grid=grid, Kpoint=kpoint, npar_k=0, fftlib=fftlib)
+    assert HH_K.dtype == np.complex128
+    assert data_32.HH_K.dtype == np.complex64
+    assert data_32.HH_K == approx(HH_K, abs=1e-5 * abs(HH_K).max())
+    assert data_32.E_K == approx(data.E_K, abs=1e-5 * abs(data.E_K).max())
+
+
+def test_data_k_no_dtype(system_Fe_W90, monkeypatch):
+    """Systems saved by older versions have no `dtype` attribute."""
+    system = system_Fe_W90
+    grid = wberri.Grid(system, NKFFT=[4, 3, 2], NKdiv=1, use_symmetry=False)
+    kpoint = KpointBZparallel(K=np.zeros(3), dK=1. / grid.div, NKFFT=grid.FFT, factor=1., symgroup=None)
+    monkeypatch.delattr(system, "dtype")
+    data = get_data_k(system, kpoint.Kp_fullBZ, grid=grid, Kpoint=kpoint, npar_k=0, fftlib="numpy")
+    assert data.HH_K.dtype == np.complex128
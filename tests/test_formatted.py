@@ -5,6 +5,7 @@ import numpy as np
 import pytest
 
 import wannierberri as wberri
+from wannierberri.system import w90_files
 from wannierberri.system.w90_files import UHU, UIU, SHU, SIU, SPN
 
 
@@ -77,6 +78,19 @@ def test_formatted_spn(generate_formatted_files):
     assert np.allclose(spn_unformatted.data, spn_formatted.data)
 
 
+def test_spn_dense_npz(generate_formatted_files, tmp_path, monkeypatch):
+    """npz files written by older versions contain the dense SPN matrix"""
+    spn = SPN(os.path.join(generate_formatted_files, "GaAs"), read_npz=False, write_npz=False)
+    np.savez(tmp_path / "GaAs.spn.npz", data=spn.data)
+    spn_dense = SPN(str(tmp_path / "GaAs"))
+    assert np.allclose(spn_dense.data, spn.data)  # up to the (negligible) imaginary part of the diagonal
+    # the dense matrix evaluated by several chunks of k-points
+    monkeypatch.setattr(w90_files, "SPN_DENSE_CHUNK_BYTES", spn.NB ** 2 * 3 * 16 * 3)
+    chunks = list(spn.dense_chunks())
+    assert len(chunks) == -(-spn.NK // 3)
+    assert np.array_equal(np.concatenate([S for _, S in chunks]), spn.data)
+
+
 def test_formatted_sXu(generate_formatted_files):
     data_dir = generate_formatted_files
     sHu_unformatted = SHU(os.path.join(data_dir, "GaAs"))
@@ -273,7 +273,7 @@ def test_Fe(check_run, system_Fe_W90, compare_any_result, compare_fermisurfer):
             precision=-1e-8,
             result_type=EnergyResult)
 
-    extra_precision = {'Morb': 1e-6, 'Der_berry': 5e-8}
+    extra_precision = {'Morb': 1e-6, 'Der_berry': 1e-7}
     npz_tabulate = os.path.join(OUTPUT_DIR, "berry_Fe_W90-tabulate-run.npz")
     for quant in result.results.get("tabulate").results.keys():  # ["Energy", "berry","Der_berry","spin","morb"]:
         for comp in result.results.get("tabulate").results.get(quant).get_component_list():
@@ -5,6 +5,7 @@ import numpy as np
 import pytest
 from packaging.version import parse as pversion
 import wannierberri.symmetry as sym
+from wannierberri.system.system import _build_group
 
 from common_systems import symmetries_GaAs, symmetries_Fe
 
@@ -85,3 +86,22 @@ def test_symmetry_spglib_Fe(system_Fe_W90, check_symgroup_equal):
     # Raise error if magnetic_moments is set to a number, not a 3d vector
     with pytest.raises(Exception):
         system_spglib.set_structure(positions, labels, [1.])
+
+
+def test_symmetry_group_cached(system_GaAs_W90, check_symgroup_equal):
+    system1 = deepcopy(system_GaAs_W90)
+    system2 = deepcopy(system_GaAs_W90)
+    system1.set_symmetry(symmetries_GaAs)
+    hits = _build_group.cache_info().hits
+    system2.set_symmetry(symmetries_GaAs)
+    assert _build_group.cache_info().hits == hits + 1
+    check_symgroup_equal(system1.symgroup, sym.Group(symmetries_GaAs, real_lattice=system1.real_lattice))
+    check_symgroup_equal(system2.symgroup, system1.symgroup)
+    # the systems do not share the cached group
+    assert system1.symgroup is not system2.symgroup
+    size = system2.symgroup.size
+    real_lattice = system2.symgroup.real_lattice.copy()
+    system1.symgroup.symmetries.pop()
+    system1.symgroup.real_lattice[0, 0] += 1
+    assert system2.symgroup.size == size
+    assert np.array_equal(system2.symgroup.real_lattice, real_lattice)
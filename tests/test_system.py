@@ -455,3 +455,21 @@ def test_system_random_GaAs_load_ws_sym(check_system, system_random_GaAs_load_ws
         matrices=['Ham', 'AA', 'SS'],
         sort_iR=False
     )
+
+
+def test_system_Fe_W90_chk_rewritten(create_files_Fe_W90, tmp_path):
+    """the system does not keep views of the .chk file, which may be rewritten by another run of wannier90"""
+    import shutil
+    for ext in "chk", "eig", "mmn", "win":
+        shutil.copy(os.path.join(create_files_Fe_W90, "Fe." + ext), tmp_path)
+    seedname = str(tmp_path / "Fe")
+    system = wberri.system.System_w90(seedname, read_npz=False, write_npz_list=[])
+    chk = tmp_path / "Fe.chk"
+    content = chk.read_bytes()
+    chk.write_bytes(b"")   # truncated in place, as when wannier90 starts writing it
+    NKFFT = system.NKFFT_recommended
+    wannier_centers_cart = system.wannier_centers_cart
+    chk.write_bytes(content)
+    assert NKFFT.flags.writeable
+    assert wannier_centers_cart.flags.writeable
+    assert np.all(NKFFT > 0)
@@ -13,6 +13,7 @@
 
 import scipy.io
 import fortio
+import mmap
 import os
 from time import time
 from functools import cached_property, lru_cache
@@ -42,6 +43,81 @@ class FortranFileR(fortio.FortranFile):
             super().__init__(filename, mode='r', header_dtype='int32', auto_endian=True, check_file=True)
 
 
+class FortranFileMmap:
+    """
+    Reads an unformatted sequential Fortran file, like :class:`FortranFileR`, but through a memory map of the
+    whole file: the records are returned as read-only arrays sharing the memory with the file (no copy).
+    Only little-endian files without sub-records are supported, otherwise `ValueError` is raised
+    """
+
+    def __init__(self, filename):
+        print("using mmap to read")
+        with open(filename, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # the records are read once, from the beginning to the end : let the kernel read ahead aggressively
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        # check all record markers in advance, so that the reader never fails in the middle of a file
+        self._offsets = []
+        offset = 0
+        while offset < len(self._mmap):
+            length = self._marker(offset)
+            end = offset + 4 + length
+            if end + 4 > len(self._mmap) or self._marker(end) != length:
+                raise ValueError(f"File '{filename}' is not a little-endian Fortran file without sub-records")
+            self._offsets.append((offset + 4, length))
+            offset = end + 4
+        self._irec = 0
+
+    def _marker(self, offset):
+        return int(np.frombuffer(self._mmap, dtype='<u4', count=1, offset=offset)[0])
+
+    def read_record(self, dtype):
+        dtype = np.dtype(dtype)
+        offset, length = self._offsets[self._irec]
+        self._irec += 1
+        return np.frombuffer(self._mmap, dtype=dtype, count=length // dtype.itemsize, offset=offset)
+
+    def read_records(self, dtype, nrec, prefetch=True):
+        """
+        read `nrec` successive records of the same length at once. If `prefetch`, the kernel is asked to start
+        reading them in the background (otherwise only the pages which are actually accessed are read)
+
+        Returns
+        -------
+        array(nrec, n)
+            a read-only view of the file, the record markers are skipped by the strides
+        """
+        dtype = np.dtype(dtype)
+        records = self._offsets[self._irec:self._irec + nrec]
+        if len(records) < nrec:
+            raise ValueError(f"requested {nrec} records, but only {len(records)} are left")
+        offset, length = records[0]
+        if any(rec_length != length for _, rec_length in records):
+            raise ValueError(f"the {nrec} records have different lengths")
+        self._irec += nrec
+        if prefetch:
+            self._willneed(offset, nrec * (length + 8))
+        return np.ndarray((nrec, length // dtype.itemsize), dtype=dtype, buffer=self._mmap, offset=offset,
+                          strides=(length + 8, dtype.itemsize))
+
+    def _willneed(self, offset, length):
+        """ask the kernel to start reading the pages in the background, before they are accessed"""
+        if hasattr(mmap, "MADV_WILLNEED"):
+            start = offset - offset % mmap.PAGESIZE
+            self._mmap.madvise(mmap.MADV_WILLNEED, start, min(offset + length, len(self._mmap)) - start)
+
+    def close(self):
+        """drop the reference to the memory map, it is unmapped once the arrays read from it are deleted"""
+        self._mmap = None
+
+    def skip_record(self, nrec=1):
+        """skip the next `nrec` records, like `fortio.FortranFile.skip_record`, returns the number of skipped bytes"""
+        total = sum(length for _, length in self._offsets[self._irec:self._irec + nrec])
+        self._irec += nrec
+        return total
+
+
 class FortranFileW(scipy.io.FortranFile):
 
     def __init__(self, filename):
@@ -155,11 +231,13 @@ def fourier_q_to_R(AA_q, mp_grid, kpt_mp_grid, iRvec, ndegen, numthreads=1, fftl
 
 class FFT_R_to_k:
 
-    def __init__(self, iRvec, NKFFT, num_wann, numthreads=1, fftlib='fftw', name=None):
+    def __init__(self, iRvec, NKFFT, num_wann, numthreads=1, fftlib='fftw', name=None, dtype=complex):
         t0 = time()
         self.NKFFT = tuple(NKFFT)
         self.num_wann = num_wann
         self.name = name
+        # complex type of the result (e.g. np.complex64 for single precision)
+        self.dtype = np.dtype(dtype)
         fftlib = fftlib.lower()
         assert fftlib in ('fftw', 'numpy', 'slow'), f"fftlib '{fftlib}' is unknown/not supported"
         if fftlib == 'fftw' and not PYFFTW_IMPORTED:
@@ -167,8 +245,8 @@ class FFT_R_to_k:
         self.lib = fftlib
         if fftlib == 'fftw':
             shape = self.NKFFT + (self.num_wann, self.num_wann)
-            fft_in = pyfftw.empty_aligned(shape, dtype='complex128')
-            fft_out = pyfftw.empty_aligned(shape, dtype='complex128')
+            fft_in = pyfftw.empty_aligned(shape, dtype=self.dtype)
+            fft_out = pyfftw.empty_aligned(shape, dtype=self.dtype)
             self.fft_plan = pyfftw.FFTW(
                 fft_in,
                 fft_out,
@@ -225,11 +303,11 @@ class FFT_R_to_k:
                                 for R, A in zip(self.iRvec, AAA_R)) for k[2] in range(self.NKFFT[2])
                         ] for k[1] in range(self.NKFFT[1])
                     ] for k[0] in range(self.NKFFT[0])
-                ])
+                ]).astype(self.dtype, copy=False)
         else:
             assert self.nRvec == shapeA[0]
             assert self.num_wann == shapeA[1] == shapeA[2]
-            AAA_K = np.zeros(self.NKFFT + shapeA[1:], dtype=complex)
+            AAA_K = np.zeros(self.NKFFT + shapeA[1:], dtype=self.dtype)
             # TODO : place AAA_R to FFT grid from beginning, even before multiplying by exp(dkR)
             for ir, irvec in enumerate(self.iRvec):
                 AAA_K[tuple(irvec)] += AAA_R[ir]
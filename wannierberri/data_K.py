@@ -117,6 +117,8 @@ class _Data_K(System, abc.ABC):
         self.random_gauge = random_gauge
         self.degen_threshold_random_gauge = degen_thresh_random_gauge
         self.force_internal_terms_only = system.force_internal_terms_only
+        # Systems pickled by older versions have no `dtype`
+        self.dtype = getattr(system, 'dtype', np.dtype(complex))
         self.grid = grid
         self.NKFFT = grid.FFT
         self.select_K = np.ones(self.nk, dtype=bool)
@@ -608,7 +610,8 @@ class Data_K_R(_Data_K, System_R):
             self.NKFFT,
             self.num_wann,
             numthreads=self.npar_k if self.npar_k > 0 else 1,
-            fftlib=self.fftlib)
+            fftlib=self.fftlib,
+            dtype=self.dtype)
 
         self.expdK = np.exp(2j * np.pi * self.system.iRvec.dot(dK))
         self.dK = dK
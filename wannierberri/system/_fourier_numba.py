@@ -0,0 +1,53 @@
+#                                                            #
+# This file is distributed as part of the WannierBerri code  #
+# under the terms of the GNU General Public License. See the #
+# file `LICENSE' in the root directory of the WannierBerri   #
+# distribution, or http://www.gnu.org/copyleft/gpl.txt       #
+#                                                            #
+# The WannierBerri code is hosted on GitHub:                 #
+# https://github.com/stepan-tsirkin/wannier-berri            #
+#                     written by                             #
+#           Stepan Tsirkin, University of Zurich             #
+#                                                            #
+# ------------------------------------------------------------
+"""Numba kernel of the Fourier transform to arbitrary k-points, used by :meth:`System.fourier_R_to_k`
+for systems with a small number of Wannier functions, where the einsum is dominated by the call overhead"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(fastmath=True, cache=True)
+def _fourier_kernel(kpoints, Rx, Ry, Rz, matrix_R, out):
+    """
+    out[ik, m, n, x] += sum_R exp(2*pi*i*k.R) matrix_R[iR, m, n, x]
+    the components of the R-vectors are given as separate contiguous arrays `Rx`, `Ry`, `Rz`.
+    The loop over k-points is not parallel: the kernel is used for small systems, and numba's parallel
+    threading layer may hang the process at exit if a `multiprocessing.Pool` forks after it
+    """
+    twopi = 2 * np.pi
+    for ik in range(kpoints.shape[0]):
+        k0 = twopi * kpoints[ik, 0]
+        k1 = twopi * kpoints[ik, 1]
+        k2 = twopi * kpoints[ik, 2]
+        for iR in range(Rx.shape[0]):
+            ph = np.exp(1j * (k0 * Rx[iR] + k1 * Ry[iR] + k2 * Rz[iR]))
+            for m in range(matrix_R.shape[1]):
+                for n in range(matrix_R.shape[2]):
+                    for x in range(matrix_R.shape[3]):
+                        out[ik, m, n, x] += ph * matrix_R[iR, m, n, x]
+
+
+def fourier_R_to_k_numba(matrix_R, kpoints, Rx, Ry, Rz, dtype=complex):
+    """
+    Fourier transform of `matrix_R` of shape `(num_wann, num_wann, nRvec, ...)`
+    to the k-points `kpoints` (reduced coordinates). Returns array `(nk, num_wann, num_wann, ...)` of type `dtype`
+    `Rx`, `Ry`, `Rz` are the components of the R-vectors (reduced coordinates) as float arrays
+    """
+    shape = matrix_R.shape
+    # the kernel needs the R index first, and all cartesian indices combined into one
+    mat = np.ascontiguousarray(matrix_R.reshape(shape[:3] + (-1,)).transpose(2, 0, 1, 3), dtype=dtype)
+    out = np.zeros((kpoints.shape[0],) + shape[:2] + (mat.shape[3],), dtype=dtype)
+    _fourier_kernel(np.ascontiguousarray(kpoints, dtype=float), np.ascontiguousarray(Rx), np.ascontiguousarray(Ry),
+                    np.ascontiguousarray(Rz), mat, out)
+    return out.reshape((kpoints.shape[0],) + shape[:2] + shape[3:])
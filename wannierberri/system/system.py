@@ -11,31 +11,124 @@
 #                                                            #
 # ------------------------------------------------------------
 
+import math
+import os
 import numpy as np
-from functools import cached_property
-from ..symmetry import Group
-from ..__utility import real_recip_lattice
+from copy import deepcopy
+from functools import lru_cache
 
 pauli_x = [[0, 1], [1, 0]]
 pauli_y = [[0, -1j], [1j, 0]]
 pauli_z = [[1, 0], [0, -1]]
-pauli_xyz = np.array([pauli_x, pauli_y, pauli_z]).transpose((1, 2, 0))
+pauli_xyz = np.ascontiguousarray(np.stack([pauli_x, pauli_y, pauli_z], axis=-1), dtype=np.complex128)
+pauli_xyz.setflags(write=False)
+
+
+@lru_cache()
+def spin_operator(nwann_orbital):
+    r"""
+    returns the (read-only) matrix of Pauli matrices for `nwann_orbital` spinor orbitals,
+    i.e. :math:`1_{n}\otimes\sigma_a` of shape `(2*nwann_orbital, 2*nwann_orbital, 3)`,
+    assuming the spin-up and spin-down components of each orbital to be neighbours (as in QE)
+    """
+    identity = np.eye(nwann_orbital)
+    spin = np.ascontiguousarray(np.stack([np.kron(identity, pauli_xyz[:, :, a]) for a in range(3)], axis=-1))
+    spin.setflags(write=False)
+    return spin
+
+
+# number of cartesian dimensions of the matrices, by key
+_NCART = {**dict.fromkeys(("Ham",), 0),
+          **dict.fromkeys(("AA", "BB", "CC", "SS", "SH", "OO"), 1),
+          **dict.fromkeys(("SHA", "SA", "SR", "SHR", "GG", "FF"), 2)}
 
 
 def num_cart_dim(key):
     """
     returns the number of cartesian dimensions of a matrix by key
     """
-    if key in ["Ham"]:
-        return 0
-    elif key in ["AA", "BB", "CC", "SS", "SH", "OO"]:
-        return 1
-    elif key in ["SHA", "SA", "SR", "SHR", "GG", "FF"]:
-        return 2
-    else:
+    try:
+        return _NCART[key]
+    except KeyError:
         raise ValueError(f"unknown matrix {key}")
 
 
+class _cached_property:
+    """
+    A lightweight replacement of :func:`functools.cached_property` without the per-instance lock.
+    The value is evaluated on first access and stored in the instance `__dict__`,
+    where it further shadows the descriptor, so that next accesses are plain attribute lookups
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.func(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+# above this size (nk*nRvec*num_wann**2) the matrices with cartesian indices are Fourier-transformed
+# by a loop over the first cartesian index, which reduces the memory traffic of every contraction
+FOURIER_TENSORDOT_THRESHOLD = 2 ** 24
+# for systems with less Wannier functions the Fourier transform is done by a numba kernel
+FOURIER_NUMBA_MAX_NUM_WANN = 24
+# number of R-vectors read at once when Fourier-transforming a matrix stored on disk
+FOURIER_R_CHUNK = 64
+# default complex type of the Fourier-transformed matrices. Single precision may be enabled by `WB_USE_FP32=1`
+FOURIER_DTYPE = np.complex64 if os.environ.get("WB_USE_FP32", "0") == "1" else np.complex128
+
+
+@lru_cache(maxsize=128)
+def _einsum_path(expr, *shapes):
+    """
+    returns the optimal contraction path of `np.einsum(expr, ...)` for operands of given shapes.
+    It is evaluated only once for each combination of expression and shapes
+    """
+    return np.einsum_path(expr, *[np.empty(s) for s in shapes], optimize='optimal')[0]
+
+
+def _einsum(expr, *operands):
+    """`np.einsum` with the cached optimal contraction path"""
+    return np.einsum(expr, *operands, optimize=_einsum_path(expr, *[op.shape for op in operands]))
+
+
+def _symmetry_key(op):
+    """returns a hashable representation of a symmetry generator, given as `str` or :class:`~wannierberri.symmetry.Symmetry`"""
+    if isinstance(op, str):
+        return op
+    dic = op.as_dict()
+    return np.array(dic['R'], dtype=float).tobytes(), bool(dic['TR'])
+
+
+def _real_recip_lattice(real_lattice=None, recip_lattice=None):
+    # imported here rather than inside the methods, where the double underscore would be name-mangled
+    from ..__utility import real_recip_lattice
+    return real_recip_lattice(real_lattice=real_lattice, recip_lattice=recip_lattice)
+
+
+@lru_cache(maxsize=64)
+def _build_group(generators_key, real_lattice_bytes, recip_lattice_bytes):
+    """
+    builds the symmetry group from the generators (see :func:`_symmetry_key`) and the lattices (given as bytes),
+    the results are cached, so that the group closure is not repeated for systems with the same symmetries.
+    The cached group should not be modified, :meth:`System.set_symmetry` stores a copy of it
+    """
+    from ..symmetry import Group, Symmetry
+    generators = [op if isinstance(op, str) else Symmetry(np.frombuffer(op[0]).reshape(3, 3), TR=op[1])
+                  for op in generators_key]
+    return Group(generators,
+                 real_lattice=np.frombuffer(real_lattice_bytes).reshape(3, 3),
+                 recip_lattice=np.frombuffer(recip_lattice_bytes).reshape(3, 3))
+
+
 class System:
 
     """
@@ -56,41 +149,54 @@ class System:
         the internal terms are defined only by the Hamiltonian and spin
     name : str
         name that will be used by default in names of output files
+    dtype : numpy dtype
+        complex type of the matrices Fourier-transformed to k-space: by the FFT in :class:`~wannierberri.data_K.Data_K`
+        (i.e. in all calculations), by :meth:`fourier_R_to_k` and by :meth:`fourier_on_grid`.
+        ``np.complex64`` halves the memory traffic at the price of precision.
+        Default: ``np.complex128`` (or ``np.complex64`` if the environment variable ``WB_USE_FP32=1``)
     """
 
     def __init__(self,
-                 frozen_max=-np.Inf,
+                 frozen_max=-math.inf,
                  periodic=(True, True, True),
                  NKFFT=None,
                  force_internal_terms_only=False,
-                 name='wberri'
+                 name='wberri',
+                 dtype=None
                  ):
 
         # TODO: move some initialization to child classes
-        self.frozen_max = frozen_max
-        self.periodic = periodic
+        self.frozen_max = float(frozen_max)
         self.name = name
+        self.real_lattice = None
 
 
         if NKFFT is not None:
             self._NKFFT_recommended = NKFFT
 
-        self.periodic = np.zeros(3, dtype=bool)
-        self.periodic[:len(self.periodic)] = periodic
+        p = list(periodic) + [False] * (3 - len(periodic))
+        self.periodic = (bool(p[0]), bool(p[1]), bool(p[2]))
         self.is_phonon = False
-        self.force_internal_terms_only = force_internal_terms_only
+        self.force_internal_terms_only = bool(force_internal_terms_only)
+        self.dtype = np.dtype(FOURIER_DTYPE if dtype is None else dtype)
+        assert self.dtype.kind == 'c', f"dtype should be complex, found {self.dtype}"
 
 
     def set_real_lattice(self, real_lattice=None, recip_lattice=None):
-        assert not hasattr(self, 'real_lattice')
-        self.real_lattice, _ = real_recip_lattice(real_lattice=real_lattice, recip_lattice=recip_lattice)
+        if self.real_lattice is not None:
+            raise RuntimeError("real_lattice already set")
+        # the reciprocal lattice is stored as well, it shadows the `recip_lattice` cached property
+        self.real_lattice, self.recip_lattice = _real_recip_lattice(real_lattice=real_lattice,
+                                                                    recip_lattice=recip_lattice)
 
 
 
-    @cached_property
+    @_cached_property
     def recip_lattice(self):
-        real, recip = real_recip_lattice(real_lattice=self.real_lattice)
-        return recip
+        """evaluated from `real_lattice`, unless it was stored by :meth:`set_real_lattice`"""
+        a1, a2, a3 = np.array(self.real_lattice, dtype=float)
+        cross = np.array([np.cross(a2, a3), np.cross(a3, a1), np.cross(a1, a2)])
+        return 2 * np.pi * cross / np.dot(a1, cross[0])
 
     def set_symmetry(self, symmetry_gen=()):
         """
@@ -111,16 +217,108 @@ class System:
         + Only the **point group** operations are important. Hence, for non-symmorphic operations, only the rotational part should be given, neglecting the translation.
 
         """
-        self.symgroup = Group(symmetry_gen, recip_lattice=self.recip_lattice, real_lattice=self.real_lattice)
+        self.symgroup = deepcopy(_build_group(tuple(_symmetry_key(op) for op in symmetry_gen),
+                                              np.array(self.real_lattice, dtype=float).tobytes(),
+                                              np.array(self.recip_lattice, dtype=float).tobytes()))
+
+
+    def fourier_R_to_k(self, matrix_R, kpoints, key=None):
+        r"""
+        Fourier transform of a real-space matrix to an arbitrary set of k-points
+        :math:`X(\mathbf{k}) = \sum_{\mathbf{R}} e^{2\pi i \mathbf{k}\cdot\mathbf{R}} X(\mathbf{R})`.
+        Requires the R-vectors `iRvec` to be set.
+
+        Parameters
+        ----------
+        matrix_R : array(num_wann, num_wann, nRvec, ...)
+            the real-space matrix. `...` denotes the cartesian dimensions (see :func:`num_cart_dim`).
+            May also be an array stored on disk, e.g. a `np.memmap` (``np.load(..., mmap_mode='r')``)
+            or a `h5py.Dataset`. Then it is read and transformed by chunks of `FOURIER_R_CHUNK` R-vectors
+        kpoints : array(nk, 3)
+            k-points in reduced coordinates
+        key : str
+            the name of the matrix ('Ham', 'AA', ...). If given, it defines the number of cartesian dimensions,
+            otherwise they are deduced from the shape of `matrix_R`
+
+        Returns
+        -------
+        array(nk, num_wann, num_wann, ...) of type :attr:`dtype`
+        """
+        kpoints = np.atleast_2d(kpoints)
+        ncart = matrix_R.ndim - 3 if key is None else num_cart_dim(key)
+        assert matrix_R.ndim == 3 + ncart, f"matrix {key} should have {3 + ncart} dimensions, found {matrix_R.ndim}"
+        Rx, Ry, Rz = self.Rvec_soa
+        if isinstance(matrix_R, np.memmap) or not isinstance(matrix_R, np.ndarray):
+            # the matrix is stored on disk - read it by chunks of R-vectors, so that it is never fully in memory
+            result = 0
+            for start in range(0, matrix_R.shape[2], FOURIER_R_CHUNK):
+                sl = slice(start, start + FOURIER_R_CHUNK)
+                result += self._fourier_R_to_k(np.asarray(matrix_R[:, :, sl]), kpoints,
+                                               Rx[sl], Ry[sl], Rz[sl], ncart)
+            return result
+        return self._fourier_R_to_k(matrix_R, kpoints, Rx, Ry, Rz, ncart)
+
+    def _fourier_R_to_k(self, matrix_R, kpoints, Rx, Ry, Rz, ncart):
+        """the Fourier transform for a matrix in memory, see :meth:`fourier_R_to_k`"""
+        if matrix_R.shape[0] < FOURIER_NUMBA_MAX_NUM_WANN:
+            # numba is imported only when the kernel is used
+            from ._fourier_numba import fourier_R_to_k_numba
+            return fourier_R_to_k_numba(matrix_R, kpoints, Rx, Ry, Rz, dtype=self.dtype)
+        phase = np.exp(2j * np.pi * (kpoints[:, 0, None] * Rx + kpoints[:, 1, None] * Ry + kpoints[:, 2, None] * Rz))
+        phase = phase.astype(self.dtype, copy=False)
+        matrix_R = matrix_R.astype(self.dtype, copy=False)
+        if ncart >= 1 and phase.shape[0] * np.prod(matrix_R.shape[:3]) > FOURIER_TENSORDOT_THRESHOLD:
+            return np.stack([np.tensordot(phase, matrix_R[:, :, :, a], axes=([1], [2]))
+                             for a in range(matrix_R.shape[3])], axis=3)
+        return _einsum('kR,mnR...->kmn...', phase, matrix_R)
+
+    def fourier_on_grid(self, matrix_R, grid_shape):
+        r"""
+        Fourier transform of a real-space matrix to a regular grid of k-points :math:`k_i=j_i/N_i`,
+        evaluated by FFT. Equivalent to :meth:`fourier_R_to_k` with the k-points of the grid,
+        but scales as :math:`N_k\log N_k` instead of :math:`N_k N_R`.
+
+        Parameters
+        ----------
+        matrix_R : array(num_wann, num_wann, nRvec, ...)
+            the real-space matrix
+        grid_shape : tuple(int, int, int)
+            the size of the grid :math:`(N_1, N_2, N_3)`
+
+        Returns
+        -------
+        array(nk, num_wann, num_wann, ...) of type :attr:`dtype`
+            the k-points are ordered as ``itertools.product(*[range(n) for n in grid_shape])``
+        """
+        grid_shape = tuple(int(n) for n in grid_shape)
+        assert len(grid_shape) == 3, f"grid_shape should have 3 elements, found {grid_shape}"
+        A_R = np.moveaxis(matrix_R, 2, 0)
+        A_K = np.zeros(grid_shape + A_R.shape[1:], dtype=self.dtype)
+        # R-vectors that are equivalent modulo the grid are summed up
+        np.add.at(A_K, tuple((self.iRvec % grid_shape).T), A_R)
+        nk = grid_shape[0] * grid_shape[1] * grid_shape[2]
+        import scipy.fft
+        A_K = scipy.fft.ifftn(A_K, axes=(0, 1, 2), overwrite_x=True, workers=-1)
+        A_K *= nk
+        return A_K.reshape((nk,) + A_R.shape[1:])
 
+    @_cached_property
+    def Rvec_soa(self):
+        """the components of the R-vectors (reduced coordinates) as three contiguous float arrays"""
+        R = np.array(self.iRvec, dtype=float)
+        return tuple(np.ascontiguousarray(R[:, i]) for i in range(3))
 
-    @cached_property
+    @_cached_property
     def cell_volume(self):
-        return abs(np.linalg.det(self.real_lattice))
+        a1, a2, a3 = np.array(self.real_lattice, dtype=float)
+        return math.fabs(float(np.dot(a1, np.cross(a2, a3))))
 
-    @cached_property
+    @_cached_property
     def range_wann(self):
-        return np.arange(self.num_wann)
+        # int32 is enough to index the Wannier functions and halves the footprint of the index vector
+        rw = np.arange(self.num_wann, dtype=np.int32)
+        rw.setflags(write=False)
+        return rw
 
 
 
@@ -480,7 +480,7 @@ class System_R(System):
             return self.cRvec[None, None, :, :]
 
     def clear_cached_R(self):
-        clear_cached(self, ['cRvec', 'cRvec_p_wcc', 'reverseR'])
+        clear_cached(self, ['cRvec', 'cRvec_p_wcc', 'reverseR', 'Rvec_soa'])
 
     @cached_property
     def diff_wcc_cart(self):
@@ -786,6 +786,8 @@ class System_R(System):
             a = np.load(os.path.join(path, key + ".npz"), allow_pickle=False)
             if key == 'symgroup':
                 val = Group(dictionary=a)
+            elif key == 'periodic':
+                val = tuple(bool(x) for x in a['arr_0'])
             else:
                 val = a['arr_0']
             setattr(self, key, val)
@@ -42,6 +42,7 @@ class SystemSparse(System_R):
         for m in matrices.values():
             irvec_set.update(set(list(m.keys())))
         self.iRvec = np.array(list(irvec_set))
+        iR_lookup = {R: iR for iR, R in enumerate(irvec_set)}
 
         for k, v in matrices.items():
             shape = getshape(v)
@@ -49,7 +50,7 @@ class SystemSparse(System_R):
                 print((self.num_wann, self.num_wann, self.nRvec) + shape)
                 X = np.zeros((self.num_wann, self.num_wann, self.nRvec) + shape, dtype=complex)
                 for R, v1 in v.items():
-                    iR = self.iRvec.tolist().index(list(R))
+                    iR = iR_lookup[tuple(R)]
                     for j, h in v1.items():
                         X[j[0], j[1], iR] = h
                 self.set_R_mat(k, X)
@@ -82,7 +82,7 @@ class System_tb_py(System_R):
         self.real_lattice[:self.dimr, :self.dimr] = np.array(real)
         self.wannier_centers_cart = wannier_centers_reduced.dot(self.real_lattice)
 
-        self.periodic[self.dimr:] = False
+        self.periodic = tuple(per and i < self.dimr for i, per in enumerate(self.periodic))
         Rvec = [tuple(row) for row in Rvec]
         Rvecs = np.unique(Rvec, axis=0).astype('int32')
 
@@ -19,7 +19,7 @@ import multiprocessing
 import warnings
 from ..__utility import real_recip_lattice, fourier_q_to_R, alpha_A, beta_A
 from .system_R import System_R
-from .w90_files import Wannier90data
+from .w90_files import Wannier90data, release_buffer, clear_buffer_pool
 from .ws_dist import wigner_seitz
 
 
@@ -43,6 +43,10 @@ class System_w90(System_R):
         Wannier centers calculated from Wannier90.
     npar : int
         number of processes used in the constructor
+    npar_k : int
+        number of k-point pools, evaluated by parallel threads, to transform the matrix elements
+        from the ab initio mesh to the Wannier gauge (see `~wannierberri.system.w90_files.einsum_kpool`),
+        and to read the uHu, uIu, sHu and sIu files
     fft : str
         library used to perform the fast Fourier transform from **q** to **R**. ``fftw`` or ``numpy``. (practically does not affect performance,
         anyway mostly time of the constructor is consumed by reading the input files)
@@ -70,6 +74,7 @@ class System_w90(System_R):
             guiding_centers=False,
             fftlib='fftw',
             npar=multiprocessing.cpu_count(),
+            npar_k=1,
             kmesh_tol=1e-7,
             bk_complete_tol=1e-5,
             wcc_phase_fin_diff=True,
@@ -115,7 +120,7 @@ class System_w90(System_R):
             w90data = Wannier90data(self.seedname, read_chk=True, kmesh_tol=kmesh_tol, bk_complete_tol=bk_complete_tol,
                                     write_npz_list=write_npz_list, read_npz=read_npz, overwrite_npz=overwrite_npz,
                                     write_npz_formatted=write_npz_formatted,
-                                    formatted=formatted)
+                                    formatted=formatted, npar_k=npar_k)
         w90data.check_wannierised(msg="creation of System_Wannierise")
         chk = w90data.chk
         self.real_lattice, self.recip_lattice = real_recip_lattice(chk.real_lattice, chk.recip_lattice)
@@ -158,7 +163,7 @@ class System_w90(System_R):
         w90data.mmn.set_bk_chk(chk)
 
         # H(R) matrix
-        HHq = chk.get_HH_q(w90data.eig)
+        HHq = chk.get_HH_q(w90data.eig, npar_k=npar_k)
         self.set_R_mat('Ham', fourier_q_to_R_loc(HHq))
 
         # Wannier centers
@@ -184,12 +189,13 @@ class System_w90(System_R):
 
         # A_a(R,b) matrix
         if self.need_R_any('AA'):
-            AA_qb = chk.get_AA_qb(w90data.mmn, transl_inv=transl_inv, sum_b=sum_b, phase=expjphase1)
+            AA_qb = chk.get_AA_qb(w90data.mmn, transl_inv=transl_inv, sum_b=sum_b, phase=expjphase1, npar_k=npar_k)
             AA_Rb = fourier_q_to_R_loc(AA_qb)
+            release_buffer(AA_qb)
             self.set_R_mat('AA', AA_Rb, Hermitian=True)
             # Checking Wannier_centers
             if True:
-                AA_q = chk.get_AA_qb(w90data.mmn, transl_inv=True, sum_b=True, phase=None)
+                AA_q = chk.get_AA_qb(w90data.mmn, transl_inv=True, sum_b=True, phase=None, npar_k=npar_k)
 #                AA_R0 = fourier_q_to_R_loc(AA_q)[:, :, self.iR0]
                 AA_R0 = AA_q.sum(axis=0) / np.prod(mp_grid)
                 wannier_centers_cart_new = np.diagonal(AA_R0, axis1=0, axis2=1).T
@@ -212,46 +218,51 @@ class System_w90(System_R):
 
         # B_a(R,b) matrix
         if 'BB' in self.needed_R_matrices:
-            BB_qb = chk.get_BB_qb(w90data.mmn, w90data.eig, sum_b=sum_b, phase=expjphase1)
+            BB_qb = chk.get_BB_qb(w90data.mmn, w90data.eig, sum_b=sum_b, phase=expjphase1, npar_k=npar_k)
             BB_Rb = fourier_q_to_R_loc(BB_qb)
+            release_buffer(BB_qb)
             self.set_R_mat('BB', BB_Rb)
 
         # C_a(R,b1,b2) matrix
         if 'CC' in self.needed_R_matrices:
-            CC_qb = chk.get_CC_qb(w90data.mmn, w90data.uhu, sum_b=sum_b, phase=expjphase2)
+            CC_qb = chk.get_CC_qb(w90data.mmn, w90data.uhu, sum_b=sum_b, phase=expjphase2, npar_k=npar_k)
             CC_Rb = fourier_q_to_R_loc(CC_qb)
+            release_buffer(CC_qb)
             self.set_R_mat('CC', CC_Rb, Hermitian=True)
 
         # O_a(R,b1,b2) matrix
         if 'OO' in self.needed_R_matrices:
-            OO_qb = chk.get_OO_qb(w90data.mmn, w90data.uiu, sum_b=sum_b, phase=expjphase2)
+            OO_qb = chk.get_OO_qb(w90data.mmn, w90data.uiu, sum_b=sum_b, phase=expjphase2, npar_k=npar_k)
             OO_Rb = fourier_q_to_R_loc(OO_qb)
+            release_buffer(OO_qb)
             self.set_R_mat('OO', OO_Rb, Hermitian=True)
 
         # G_bc(R,b1,b2) matrix
         if 'GG' in self.needed_R_matrices:
-            GG_qb = chk.get_GG_qb(w90data.mmn, w90data.uiu, sum_b=sum_b, phase=expjphase2)
+            GG_qb = chk.get_GG_qb(w90data.mmn, w90data.uiu, sum_b=sum_b, phase=expjphase2, npar_k=npar_k)
             GG_Rb = fourier_q_to_R_loc(GG_qb)
+            release_buffer(GG_qb)
             self.set_R_mat('GG', GG_Rb, Hermitian=True)
 
 
         #######################################################################
 
         if self.need_R_any('SS'):
-            self.set_R_mat('SS', fourier_q_to_R_loc(chk.get_SS_q(w90data.spn)))
+            self.set_R_mat('SS', fourier_q_to_R_loc(chk.get_SS_q(w90data.spn, npar_k=npar_k)))
         if self.need_R_any('SR'):
-            self.set_R_mat('SR', fourier_q_to_R_loc(chk.get_SHR_q(spn=w90data.spn, mmn=w90data.mmn, phase=expjphase1)))
+            self.set_R_mat('SR', fourier_q_to_R_loc(chk.get_SHR_q(spn=w90data.spn, mmn=w90data.mmn, phase=expjphase1, npar_k=npar_k)))
         if self.need_R_any('SH'):
-            self.set_R_mat('SH', fourier_q_to_R_loc(chk.get_SH_q(w90data.spn, w90data.eig)))
+            self.set_R_mat('SH', fourier_q_to_R_loc(chk.get_SH_q(w90data.spn, w90data.eig, npar_k=npar_k)))
         if self.need_R_any('SHR'):
-            self.set_R_mat('SHR', fourier_q_to_R_loc(chk.get_SHR_q(spn=w90data.spn, mmn=w90data.mmn, eig=w90data.eig, phase=expjphase1)))
+            self.set_R_mat('SHR', fourier_q_to_R_loc(chk.get_SHR_q(spn=w90data.spn, mmn=w90data.mmn, eig=w90data.eig, phase=expjphase1, npar_k=npar_k)))
 
         if 'SA' in self.needed_R_matrices:
-            self.set_R_mat('SA', fourier_q_to_R_loc(chk.get_SHA_q(w90data.siu, w90data.mmn, phase=expjphase1)))
+            self.set_R_mat('SA', fourier_q_to_R_loc(chk.get_SHA_q(w90data.siu, w90data.mmn, phase=expjphase1, npar_k=npar_k)))
         if 'SHA' in self.needed_R_matrices:
-            self.set_R_mat('SHA', fourier_q_to_R_loc(chk.get_SHA_q(w90data.shu, w90data.mmn, phase=expjphase1)))
+            self.set_R_mat('SHA', fourier_q_to_R_loc(chk.get_SHA_q(w90data.shu, w90data.mmn, phase=expjphase1, npar_k=npar_k)))
 
         del expjphase1, expjphase2
+        clear_buffer_pool()
 
         if self.use_ws:
             self.do_ws_dist(mp_grid=mp_grid)
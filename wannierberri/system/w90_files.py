@@ -12,23 +12,203 @@
 # from the translation of Wannier90 code                     #
 # ------------------------------------------------------------#
 
-import multiprocessing
 import gc
-import functools
-from functools import cached_property
+import math
+from functools import cached_property, lru_cache
 import os.path
 import abc
+import struct
+import zipfile
 from scipy.constants import physical_constants
 from time import time
-from itertools import islice
 from copy import copy
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from numba import njit
 from .disentanglement import disentangle
-from ..__utility import FortranFileR, alpha_A, beta_A
+from ..__utility import FortranFileR, FortranFileMmap
+
+try:
+    import wannier90io as w90io
+    W90IO_IMPORTED = True
+except ImportError:
+    W90IO_IMPORTED = False
 
 readstr = lambda F: "".join(c.decode('ascii') for c in F.read_record('c')).strip()
 
 
+def kpool_slices(NK, npar_k):
+    """split the `NK` k-points into (at most) `npar_k` contiguous pools, returns a list of slices"""
+    return [slice(ik[0], ik[-1] + 1) for ik in np.array_split(np.arange(NK), max(1, min(npar_k, NK)))]
+
+
+def map_kpool(func, NK, npar_k=1):
+    """
+    call `func(sl)` for the slices `sl` of the k-points split into `npar_k` pools.
+    With `npar_k > 1` the pools are evaluated by a pool of threads, this pays off when `func` is dominated
+    by numpy copies and fancy indexing of large arrays (which release the GIL)
+    """
+    if npar_k <= 1 or NK <= 1:
+        func(slice(0, NK))
+        return
+    pools = kpool_slices(NK, npar_k)
+    with ThreadPoolExecutor(len(pools)) as executor:
+        list(executor.map(func, pools))
+
+
+def einsum_kpool(subscripts, *operands, npar_k=1):
+    """
+    `np.einsum` (with `optimize=True`) of operands which all have the k-point as the first index,
+    and so does the result. With `npar_k > 1` the k-points are split into `npar_k` pools which are evaluated
+    by a pool of threads (einsum and BLAS release the GIL), so that the large arrays are shared between the pools
+    without copying
+    """
+    if npar_k <= 1:
+        return np.einsum(subscripts, *operands, optimize=True)
+    pools = kpool_slices(operands[0].shape[0], npar_k)
+    with ThreadPoolExecutor(len(pools)) as executor:
+        result = list(executor.map(lambda sl: np.einsum(subscripts, *(op[sl] for op in operands), optimize=True),
+                                   pools))
+    return np.concatenate(result, axis=0)
+
+
+# flattened buffers returned by `release_buffer`, by (size, dtype)
+_buffer_pool = {}
+
+
+def get_zero_buffer(shape, dtype=complex):
+    """
+    a zero-filled array, which reuses a buffer returned to the pool by :func:`release_buffer`
+    (if there is one of the same size and dtype) rather than allocating a new one
+    """
+    key = (int(np.prod(shape)), np.dtype(dtype))
+    try:
+        buf = _buffer_pool[key].pop()
+    except (KeyError, IndexError):
+        return np.zeros(shape, dtype=dtype)
+    buf.fill(0)
+    return buf.reshape(shape)
+
+
+def release_buffer(buf):
+    """return the array to the pool of :func:`get_zero_buffer`. The caller should not use it afterwards"""
+    if buf.flags.c_contiguous and buf.flags.writeable:
+        _buffer_pool.setdefault((buf.size, buf.dtype), []).append(buf.reshape(-1))
+
+
+def clear_buffer_pool():
+    """free the memory held by the released buffers"""
+    _buffer_pool.clear()
+
+
+def hermitize_inplace(X):
+    """
+    replace `X[k, m, n, ...]` by `(X[k, m, n, ...] + X[k, n, m, ...].conj()) / 2` in place,
+    with only one temporary array (the conjugated transpose)
+    """
+    np.add(X, X.swapaxes(1, 2).conj(), out=X)
+    X *= 0.5
+    return X
+
+
+@njit(cache=True)
+def _spn_fill_kernel(records, indn, indm, out):
+    """
+    the kernel of :meth:`SPN.get_dense`. It is not parallel: the fill is limited by the memory bandwidth,
+    and numba's parallel threading layer may hang the process if a `multiprocessing.Pool` forks after it
+
+    records[ik, ipair, ipol] = <u_{n,k}|S_ipol|u_{m,k}> for n, m = indn[ipair], indm[ipair] (n <= m),
+    is written to out[ik, n, m, ipol], and the complex conjugate to out[ik, m, n, ipol]
+    """
+    for ik in range(records.shape[0]):
+        for ipair in range(records.shape[1]):
+            n = indn[ipair]
+            m = indm[ipair]
+            for ipol in range(records.shape[2]):
+                val = records[ik, ipair, ipol]
+                out[ik, n, m, ipol] = val
+                out[ik, m, n, ipol] = val.conjugate()
+
+
+@lru_cache(maxsize=32)
+def _tril_pair(nbnd):
+    """
+    the indices of the pairs of bands in the packed SPN records, `(indm, indn) = np.tril_indices(nbnd)`,
+    and the mask of the diagonal pairs. Cached, therefore the arrays are read-only
+    """
+    indm, indn = np.tril_indices(nbnd)
+    diag = indm == indn
+    for a in indm, indn, diag:
+        a.setflags(write=False)
+    return indm, indn, diag
+
+
+def _spn_fill(records, indn, indm, out):
+    """
+    call :func:`_spn_fill_kernel`. The kernel accesses `records` element by element, so a strided view
+    of the file is passed as it is, only a Fortran-ordered array is made C-contiguous (numba copies and reshapes
+    of such views are not trusted). The index arrays are made C-contiguous, and `out` has to be so.
+    """
+    records = np.asarray(records)  # e.g. np.memmap
+    if records.flags.f_contiguous and not records.flags.c_contiguous:
+        records = np.ascontiguousarray(records)
+    assert out.flags.c_contiguous and out.flags.writeable
+    _spn_fill_kernel(records, np.ascontiguousarray(indn), np.ascontiguousarray(indm), out)
+
+
+@njit(nogil=True, cache=True)
+def _ccoogg_kernel(Vc, VT, uxu, swap_b, neighbours, ib_unique_map, wk, bk_cart, antisym, sum_b, phase,
+                   k_start, k_stop, out):
+    """
+    the kernel of :meth:`CheckPoint.get_CCOOGG_qb` for the k-points `k_start:k_stop`. It releases the GIL,
+    so that the pools of k-points are evaluated by threads (:func:`map_kpool`). numba's parallel threading layer
+    is not used : the fork of a `multiprocessing.Pool` after it (e.g. in ws_dist) may hang the process
+
+    Vc[ik, m, b] = v_matrix[ik, m, b].conj() , VT[ik, b, n] = v_matrix[ik, n, b]  (padded to all bands)
+    uxu : UXU.data, or UXU.data.transpose(0, 2, 1, 3, 4) (in the order of the file) if swap_b
+    phase : array(num_wann, num_wann, NNB, NNB) or None
+    out : array(num_kpts, num_wann, num_wann, NNB or 1 (if sum_b), NNB or 1, 3 (if antisym) or 9)
+    """
+    NNB = neighbours.shape[1]
+    ncomp = out.shape[-1]
+    for ik in range(k_start, k_stop):
+        fac = np.zeros(ncomp)
+        for ib1 in range(NNB):
+            iknb1 = neighbours[ik, ib1]
+            b1 = bk_cart[ik, ib1]
+            for ib2 in range(NNB):
+                iknb2 = neighbours[ik, ib2]
+                b2 = bk_cart[ik, ib2]
+                w = wk[ik, ib1] * wk[ik, ib2]
+                # Matrix < u_k+b1 | H_k | u_k+b2 > (uHu) , Hamiltonian gauge -> Wannier gauge
+                if swap_b:
+                    uxu_b = uxu[ik, ib2, ib1]
+                else:
+                    uxu_b = uxu[ik, ib1, ib2]
+                CCW = np.dot(Vc[iknb1], np.dot(uxu_b, VT[iknb2]))
+                if antisym:
+                    # Matrix for finite-difference schemes (takes antisymmetric piece only)
+                    CCW = 1.j * CCW
+                    for c in range(3):
+                        a, b = (c + 1) % 3, (c + 2) % 3
+                        fac[c] = w * (b1[a] * b2[b] - b1[b] * b2[a])
+                else:
+                    # Matrix for finite-difference schemes (takes symmetric piece only)
+                    for a in range(3):
+                        for b in range(3):
+                            fac[3 * a + b] = w * b1[a] * b2[b]
+                ibu1 = ib_unique_map[ik, ib1]
+                ibu2 = ib_unique_map[ik, ib2]
+                if phase is not None:
+                    CCW = CCW * phase[:, :, ibu1, ibu2]
+                if sum_b:
+                    ibu1 = ibu2 = 0
+                for m in range(CCW.shape[0]):
+                    for n in range(CCW.shape[1]):
+                        for c in range(ncomp):
+                            out[ik, m, n, ibu1, ibu2, c] += CCW[m, n] * fac[c]
+
+
 class CheckPoint:
     """
     A class to store the data about wannierisation, written by Wannier90
@@ -49,13 +229,23 @@ class CheckPoint:
         self.bk_complete_tol = bk_complete_tol  # will be used in set_bk
         t0 = time()
         seedname = seedname.strip()
-        FIN = FortranFileR(seedname + '.chk')
-        readint = lambda: FIN.read_record('i4')
-        readfloat = lambda: FIN.read_record('f8')
-
-        def readcomplex():
-            a = readfloat()
-            return a[::2] + 1j * a[1::2]
+        try:
+            FIN = FortranFileMmap(seedname + '.chk')
+        except ValueError:
+            FIN = FortranFileR(seedname + '.chk')
+        # the records are copied, rather than kept as views of the memory-mapped file,
+        # which may be rewritten (e.g. by another run of wannier90) while the object is alive
+        readint = lambda: np.array(FIN.read_record('i4'))
+        readfloat = lambda: np.array(FIN.read_record('f8'))
+
+        def readcomplex(copy=True):
+            # pairs of (real, imaginary) float64 have the memory layout of complex128, so the record
+            # is reinterpreted without copying. With `copy=False` the result may share the memory with the file,
+            # it is used only for the matrices which are dropped before the end of `__init__`
+            a = np.ascontiguousarray(FIN.read_record('f8'), dtype=np.float64)
+            assert a.size % 2 == 0, f"a complex record should contain an even number of floats, found {a.size}"
+            a = a.view(np.complex128)
+            return np.array(a) if copy else a
 
         print('Reading restart information from file ' + seedname + '.chk :')
         self.comment = readstr(FIN)
@@ -79,48 +269,120 @@ class CheckPoint:
             self.omega_invariant = readfloat()[0]
             lwindow = np.array(readint().reshape((self.num_kpts, self.num_bands)), dtype=bool)
             ndimwin = readint()
-            u_matrix_opt = readcomplex().reshape((self.num_kpts, self.num_wann, self.num_bands))
-            self.win_min = np.array([np.where(lwin)[0].min() for lwin in lwindow])
-            self.win_max = np.array([wm + nd for wm, nd in zip(self.win_min, ndimwin)])
+            u_matrix_opt = readcomplex(copy=False).reshape((self.num_kpts, self.num_wann, self.num_bands))
+            # the first band inside the window at each k-point
+            self.win_min = lwindow.argmax(axis=1)
+            self.win_max = self.win_min + ndimwin
         else:
-            self.win_min = np.array([0] * self.num_kpts)
-            self.win_max = np.array([self.num_wann] * self.num_kpts)
+            self.win_min = np.zeros(self.num_kpts, dtype=int)
+            self.win_max = np.full(self.num_kpts, self.num_wann)
 
-        u_matrix = readcomplex().reshape((self.num_kpts, self.num_wann, self.num_wann))
-        m_matrix = readcomplex().reshape((self.num_kpts, self.nntot, self.num_wann, self.num_wann))
+        # without disentanglement u_matrix is kept as v_matrix
+        u_matrix = readcomplex(copy=not self.have_disentangled).reshape((self.num_kpts, self.num_wann, self.num_wann))
+        FIN.skip_record()  # m_matrix is not used
         if self.have_disentangled:
-            self.v_matrix = [u.dot(u_opt[:, :nd]) for u, u_opt, nd in zip(u_matrix, u_matrix_opt, ndimwin)]
+            if np.all(ndimwin == ndimwin[0]):
+                self.v_matrix = np.matmul(u_matrix, u_matrix_opt[:, :, :ndimwin[0]])
+            else:
+                self.v_matrix = [u.dot(u_opt[:, :nd]) for u, u_opt, nd in zip(u_matrix, u_matrix_opt, ndimwin)]
         else:
-            self.v_matrix = [u for u in u_matrix]
+            self.v_matrix = u_matrix
         self._wannier_centers = readfloat().reshape((self.num_wann, 3))
         self.wannier_spreads = readfloat().reshape((self.num_wann))
-        del u_matrix, m_matrix
+        FIN.close()
+        del u_matrix
+        if self.have_disentangled:
+            del u_matrix_opt
         gc.collect()
         print(f"Time to read .chk : {time() - t0}")
 
+    @property
+    def v_matrix(self):
+        return self._v_matrix
+
+    @v_matrix.setter
+    def v_matrix(self, value):
+        # e.g. after disentanglement - drop the arrays cached from the old v_matrix
+        self._v_matrix = value
+        self.__dict__.pop('_V', None)
+        self.__dict__.pop('_Vc', None)
+
+    @cached_property
+    def _V(self):
+        """
+        `v_matrix` as an array of shape (num_kpts, num_wann, num_bands),
+        padded by zeros outside the window `win_min:win_max`
+        """
+        V = np.zeros((self.num_kpts, self.num_wann, self.num_bands), dtype=complex)
+        for ik, v in enumerate(self.v_matrix):
+            V[ik, :, self.win_min[ik]:self.win_max[ik]] = v
+        return V
+
+    @cached_property
+    def _Vc(self):
+        return self._V.conj()
+
     def wannier_gauge(self, mat, ik1, ik2):
         # data should be of form NBxNBx ...   - any form later
         if len(mat.shape) == 1:
             mat = np.diag(mat)
         assert mat.shape[:2] == (self.num_bands,) * 2, f"mat.shape={mat.shape}, num_bands={self.num_bands}"
         mat = mat[self.win_min[ik1]:self.win_max[ik1], self.win_min[ik2]:self.win_max[ik2]]
-        v1 = self.v_matrix[ik1].conj()
-        v2 = self.v_matrix[ik2].T
+        v1 = self._Vc[ik1, :, self.win_min[ik1]:self.win_max[ik1]]
+        v2 = self._V[ik2, :, self.win_min[ik2]:self.win_max[ik2]]
         return np.tensordot(
-            np.tensordot(v1, mat, axes=(1, 0)), v2, axes=(1, 0)).transpose((
+            np.tensordot(v1, mat, axes=(1, 0)), v2, axes=(1, 1)).transpose((
                                                                                0,
                                                                                -1,
                                                                            ) + tuple(range(1, mat.ndim - 1)))
 
-    def get_HH_q(self, eig):
+    def _wannier_gauge_batched(self, mat, ik_bra=None, ik_ket=None, npar_k=1, sl=slice(None)):
+        """
+        batched version of :meth:`wannier_gauge` for all k-points at once
+
+        Parameters
+        ----------
+        mat : array(num_kpts, [NNB,] [NNB,] num_bands, num_bands, ...)
+            the matrix in the Hamiltonian gauge. There is one neighbour index for each of
+            `ik_bra`, `ik_ket` which is given (in this order)
+        ik_bra, ik_ket : array(num_kpts, NNB) or None
+            the k-points of the bra and ket states (e.g. `mmn.neighbours`). If None - the same k-point
+        npar_k : int
+            number of k-point pools evaluated in parallel (see :func:`einsum_kpool`)
+        sl : slice
+            the k-points to which `mat` (and `ik_bra`, `ik_ket`) belong, if not all of them
+
+        Returns
+        -------
+        array(num_kpts, [NNB,] [NNB,] num_wann, num_wann, ...)
+        """
+        i = "" if ik_bra is None else "i"
+        j = "" if ik_ket is None else "j"
+        V_bra = self._Vc[sl] if ik_bra is None else self._Vc[ik_bra[sl]]
+        V_ket = self._V[sl] if ik_ket is None else self._V[ik_ket[sl]]
+        return einsum_kpool(f"k{i}mb,k{i}{j}bc...,k{j}nc->k{i}{j}mn...", V_bra, mat, V_ket, npar_k=npar_k)
+
+    def _phase_kb(self, phase, mmn):
+        """the phase factors `phase[m, n, ib_unique]` rearranged as [ik, ib, m, n]"""
+        return np.moveaxis(phase[:, :, mmn.ib_unique_map], (2, 3), (0, 1))
+
+    def get_HH_q(self, eig, npar_k=1):
         assert (eig.NK, eig.NB) == (self.num_kpts, self.num_bands)
-        HH_q = np.array([self.wannier_gauge(E, ik, ik) for ik, E in enumerate(eig.data)])
-        return 0.5 * (HH_q + HH_q.transpose(0, 2, 1).conj())
+        HH_q = einsum_kpool("kmb,kb,knb->kmn", self._Vc, eig.data, self._V, npar_k=npar_k)
+        return hermitize_inplace(HH_q)
 
-    def get_SS_q(self, spn):
+    def get_SS_q(self, spn, npar_k=1):
         assert (spn.NK, spn.NB) == (self.num_kpts, self.num_bands)
-        SS_q = np.array([self.wannier_gauge(S, ik, ik) for ik, S in enumerate(spn.data)])
-        return 0.5 * (SS_q + SS_q.transpose(0, 2, 1, 3).conj())
+        SS_q = self._by_spn_chunks(spn, lambda sl, S: self._wannier_gauge_batched(S, npar_k=npar_k, sl=sl))
+        return hermitize_inplace(SS_q)
+
+    @staticmethod
+    def _by_spn_chunks(spn, func):
+        """
+        evaluate `func(sl, spn.data[sl])` for the chunks of k-points of :meth:`SPN.dense_chunks`,
+        so that the dense spn matrix is not kept for all k-points. The results are concatenated along the k axis
+        """
+        return np.concatenate([func(sl, S) for sl, S in spn.dense_chunks()], axis=0)
 
     #########
     # Oscar #
@@ -132,153 +394,118 @@ class CheckPoint:
     # matrix elements for Wannier interpolation, independently of the
     # finite-difference scheme used.
 
-    def get_AABB_qb(self, mmn, transl_inv=False, eig=None, phase=None, sum_b=False):
+    def get_AABB_qb(self, mmn, transl_inv=False, eig=None, phase=None, sum_b=False, npar_k=1):
         assert (not transl_inv) or eig is None
-        if sum_b:
-            AA_qb = np.zeros((self.num_kpts, self.num_wann, self.num_wann, 3), dtype=complex)
+        # Matrix < u_k | u_k+b > (mmn), Hamiltonian gauge -> Wannier gauge
+        if eig is None:
+            AAW = self._wannier_gauge_batched(mmn.data, ik_ket=mmn.neighbours, npar_k=npar_k)
         else:
-            AA_qb = np.zeros((self.num_kpts, self.num_wann, self.num_wann, mmn.NNB, 3), dtype=complex)
-        for ik in range(self.num_kpts):
-            for ib in range(mmn.NNB):
-                iknb = mmn.neighbours[ik, ib]
-                ib_unique = mmn.ib_unique_map[ik, ib]
-                # Matrix < u_k | u_k+b > (mmn)
-                data = mmn.data[ik, ib]                   # Hamiltonian gauge
-                if eig is not None:
-                    data = data * eig.data[ik, :, None]  # Hamiltonian gauge (add energies)
-                AAW = self.wannier_gauge(data, ik, iknb)  # Wannier gauge
-                # Matrix for finite-difference schemes
-                AA_q_ik_ib = 1.j * AAW[:, :, None] * mmn.wk[ik, ib] * mmn.bk_cart[ik, ib, None, None, :]
-                # Marzari & Vanderbilt formula for band-diagonal matrix elements
-                if transl_inv:
-                    AA_q_ik_ib[range(self.num_wann), range(self.num_wann)] = -np.log(
-                        AAW.diagonal()).imag[:, None] * mmn.wk[ik, ib] * mmn.bk_cart[ik, ib, None, :]
-                if phase is not None:
-                    AA_q_ik_ib *= phase[:, :, ib_unique, None]
-                if sum_b:
-                    AA_qb[ik] += AA_q_ik_ib
-                else:
-                    AA_qb[ik, :, :, ib_unique, :] = AA_q_ik_ib
+            # the energies (of the bra states) are contracted in the same einsum, without the temporary mmn*eig array
+            AAW = einsum_kpool("kmb,kb,kibc,kinc->kimn", self._Vc, eig.data, mmn.data, self._V[mmn.neighbours],
+                               npar_k=npar_k)
+        # Matrix for finite-difference schemes
+        wbk = mmn.wk[:, :, None] * mmn.bk_cart  # (num_kpts, NNB, 3)
+        AA_q_kb = 1.j * AAW[..., None] * wbk[:, :, None, None, :]
+        # Marzari & Vanderbilt formula for band-diagonal matrix elements
+        if transl_inv:
+            iw = np.arange(self.num_wann)
+            AA_q_kb[:, :, iw, iw, :] = -np.log(AAW[:, :, iw, iw]).imag[..., None] * wbk[:, :, None, :]
+        if phase is not None:
+            AA_q_kb *= self._phase_kb(phase, mmn)[..., None]
+        if sum_b:
+            return AA_q_kb.sum(axis=1, out=get_zero_buffer((self.num_kpts, self.num_wann, self.num_wann, 3)))
+        AA_qb = get_zero_buffer((self.num_kpts, self.num_wann, self.num_wann, mmn.NNB, 3), dtype=complex)
+        # one gathered assignment AA_qb[ik, :, :, ib_unique_map[ik, ib]] = AA_q_kb[ik, ib]
+        AA_qb[np.arange(self.num_kpts)[:, None], :, :, mmn.ib_unique_map, :] = AA_q_kb
         return AA_qb
 
 
     # --- A_a(q,b) matrix --- #
 
 
-    def get_AA_qb(self, mmn, transl_inv=False, phase=None, sum_b=False):
-        return self.get_AABB_qb(mmn, transl_inv=transl_inv, phase=phase, sum_b=sum_b)
+    def get_AA_qb(self, mmn, transl_inv=False, phase=None, sum_b=False, npar_k=1):
+        return self.get_AABB_qb(mmn, transl_inv=transl_inv, phase=phase, sum_b=sum_b, npar_k=npar_k)
 
     def get_AA_q(self, mmn, transl_inv=False):
         return self.get_AA_qb(mmn=mmn, transl_inv=transl_inv).sum(axis=3)
 
     # --- B_a(q,b) matrix --- #
-    def get_BB_qb(self, mmn, eig, phase=None, sum_b=False):
-        return self.get_AABB_qb(mmn, eig=eig, phase=phase, sum_b=sum_b)
+    def get_BB_qb(self, mmn, eig, phase=None, sum_b=False, npar_k=1):
+        return self.get_AABB_qb(mmn, eig=eig, phase=phase, sum_b=sum_b, npar_k=npar_k)
 
 
-    def get_CCOOGG_qb(self, mmn, uhu, antisym=True, phase=None, sum_b=False):
+    def get_CCOOGG_qb(self, mmn, uhu, antisym=True, phase=None, sum_b=False, npar_k=1):
         nd_cart = 1 if antisym else 2
         shape_NNB = () if sum_b else (mmn.NNB, mmn.NNB)
-        shape = (self.num_kpts, self.num_wann, self.num_wann) + shape_NNB + (3,) * nd_cart
-        CC_qb = np.zeros(shape, dtype=complex)
+        NNB_out = 1 if sum_b else mmn.NNB
         if phase is not None:
-            phase = np.reshape(phase, np.shape(phase)[:4] + (1,) * nd_cart)
-        for ik in range(self.num_kpts):
-            for ib1 in range(mmn.NNB):
-                iknb1 = mmn.neighbours[ik, ib1]
-                ib1_unique = mmn.ib_unique_map[ik, ib1]
-                for ib2 in range(mmn.NNB):
-                    iknb2 = mmn.neighbours[ik, ib2]
-                    ib2_unique = mmn.ib_unique_map[ik, ib2]
-
-                    # Matrix < u_k+b1 | H_k | u_k+b2 > (uHu)
-                    data = uhu.data[ik, ib1, ib2]                 # Hamiltonian gauge
-                    CCW = self.wannier_gauge(data, iknb1, iknb2)  # Wannier gauge
-
-                    if antisym:
-                        # Matrix for finite-difference schemes (takes antisymmetric piece only)
-                        CC_q_ik_ib = 1.j * CCW[:, :, None] * (
-                            mmn.wk[ik, ib1] * mmn.wk[ik, ib2] * (
-                                mmn.bk_cart[ik, ib1, alpha_A] * mmn.bk_cart[ik, ib2, beta_A]
-                                - mmn.bk_cart[ik, ib1, beta_A] * mmn.bk_cart[ik, ib2, alpha_A]))[None, None, :]
-                    else:
-                        # Matrix for finite-difference schemes (takes symmetric piece only)
-                        CC_q_ik_ib = CCW[:, :, None, None] * (
-                                         mmn.wk[ik, ib1] * mmn.wk[ik, ib2] * (
-                                             mmn.bk_cart[ik, ib1, :, None] *
-                                             mmn.bk_cart[ik, ib2, None, :]))[None, None, :, :]
-                    if phase is not None:
-                        CC_q_ik_ib *= phase[:, :, ib1_unique, ib2_unique]
-                    if sum_b:
-                        CC_qb[ik] += CC_q_ik_ib
-                    else:
-                        CC_qb[ik, :, :, ib1_unique, ib2_unique] = CC_q_ik_ib
-        return CC_qb
+            phase = np.ascontiguousarray(np.broadcast_to(phase, (self.num_wann, self.num_wann) + np.shape(phase)[2:4]))
+        # the formatted reader returns a view of the data in the order of the file, [ik, ib2, ib1, m, n],
+        # pass it as it is, rather than copying to the [ik, ib1, ib2, m, n] order
+        uxu = uhu.data.transpose(0, 2, 1, 3, 4)
+        swap_b = uxu.flags.c_contiguous and not uhu.data.flags.c_contiguous
+        uxu = np.ascontiguousarray(uxu if swap_b else uhu.data, dtype=complex)
+        CC_qb = get_zero_buffer((self.num_kpts, self.num_wann, self.num_wann, NNB_out, NNB_out, 3 ** nd_cart), dtype=complex)
+        assert CC_qb.flags.c_contiguous
+        # numba gets only C-contiguous arrays (no-op for those which already are)
+        args = (np.ascontiguousarray(self._Vc), np.ascontiguousarray(self._V.transpose(0, 2, 1)), uxu, swap_b,
+                np.ascontiguousarray(mmn.neighbours), np.ascontiguousarray(mmn.ib_unique_map),
+                np.ascontiguousarray(mmn.wk), np.ascontiguousarray(mmn.bk_cart), antisym, sum_b, phase)
+        map_kpool(lambda sl: _ccoogg_kernel(*args, sl.start, sl.stop, CC_qb), self.num_kpts, npar_k)
+        return CC_qb.reshape((self.num_kpts, self.num_wann, self.num_wann) + shape_NNB + (3,) * nd_cart)
 
     # --- C_a(q,b1,b2) matrix --- #
-    def get_CC_qb(self, mmn, uhu, phase=None, sum_b=False):
-        return self.get_CCOOGG_qb(mmn, uhu, phase=phase, sum_b=sum_b)
+    def get_CC_qb(self, mmn, uhu, phase=None, sum_b=False, npar_k=1):
+        return self.get_CCOOGG_qb(mmn, uhu, phase=phase, sum_b=sum_b, npar_k=npar_k)
 
     # --- O_a(q,b1,b2) matrix --- #
-    def get_OO_qb(self, mmn, uiu, phase=None, sum_b=False):
-        return self.get_CCOOGG_qb(mmn, uiu, phase=phase, sum_b=sum_b)
+    def get_OO_qb(self, mmn, uiu, phase=None, sum_b=False, npar_k=1):
+        return self.get_CCOOGG_qb(mmn, uiu, phase=phase, sum_b=sum_b, npar_k=npar_k)
 
     # Symmetric G_bc(q,b1,b2) matrix
-    def get_GG_qb(self, mmn, uiu, phase=None, sum_b=False):
-        return self.get_CCOOGG_qb(mmn, uiu, antisym=False, phase=phase, sum_b=sum_b)
+    def get_GG_qb(self, mmn, uiu, phase=None, sum_b=False, npar_k=1):
+        return self.get_CCOOGG_qb(mmn, uiu, antisym=False, phase=phase, sum_b=sum_b, npar_k=npar_k)
     ###########################################################################
 
 
 
-    def get_SH_q(self, spn, eig):
-        SH_q = np.zeros((self.num_kpts, self.num_wann, self.num_wann, 3), dtype=complex)
+    def get_SH_q(self, spn, eig, npar_k=1):
         assert (spn.NK, spn.NB) == (self.num_kpts, self.num_bands)
-        for ik in range(self.num_kpts):
-            SH_q[ik, :, :, :] = self.wannier_gauge(spn.data[ik, :, :, :] * eig.data[ik, None, :, None], ik, ik)
-        return SH_q
+        # the energy of the ket state is contracted in the same einsum, without the temporary spn*eig array
+        return self._by_spn_chunks(spn, lambda sl, S: einsum_kpool(
+            "kmb,kbca,kc,knc->kmna", self._Vc[sl], S, eig.data[sl], self._V[sl], npar_k=npar_k))
 
-    def get_SHA_q(self, shu, mmn, phase=None):
+    def get_SHA_q(self, shu, mmn, phase=None, npar_k=1):
         """
         SHA or SA (if siu is used instead of shu)
         """
         mmn.set_bk_chk(self)
-        SHA_q = np.zeros((self.num_kpts, self.num_wann, self.num_wann, 3, 3), dtype=complex)
         assert shu.NNB == mmn.NNB
-        for ik in range(self.num_kpts):
-            for ib in range(mmn.NNB):
-                iknb = mmn.neighbours[ik, ib]
-                ib_unique = mmn.ib_unique_map[ik, ib]
-                SHAW = self.wannier_gauge(shu.data[ik, ib], ik, iknb)
-                if phase is not None:
-                    SHAW = SHAW * phase[:, :, ib_unique, None]
-                SHA_q_ik = 1.j * SHAW[:, :, None, :] * mmn.wk[ik, ib] * mmn.bk_cart[ik, ib, None, None, :, None]
-                SHA_q[ik] += SHA_q_ik
-        return SHA_q
-
-
+        SHAW = self._wannier_gauge_batched(shu.data, ik_ket=mmn.neighbours, npar_k=npar_k)
+        if phase is not None:
+            SHAW = SHAW * self._phase_kb(phase, mmn)[..., None]
+        return 1.j * np.einsum("kimnb,ki,kia->kmnab", SHAW, mmn.wk, mmn.bk_cart, optimize=True)
 
-    def get_SHR_q(self, spn, mmn, eig=None, phase=None):
+    def get_SHR_q(self, spn, mmn, eig=None, phase=None, npar_k=1):
         """
         SHR or SR(if eig is None)
         """
         mmn.set_bk_chk(self)
-        SHR_q = np.zeros((self.num_kpts, self.num_wann, self.num_wann, 3, 3), dtype=complex)
         assert (spn.NK, spn.NB) == (self.num_kpts, self.num_bands)
-        for ik in range(self.num_kpts):
-            SH = spn.data[ik, :, :, :]
+        phase_kb = None if phase is None else self._phase_kb(phase, mmn)
+
+        def chunk(sl, SH):
             if eig is not None:
-                SH = SH * eig.data[ik, None, :, None]
-            SHW = self.wannier_gauge(SH, ik, ik)
-            for ib in range(mmn.NNB):
-                iknb = mmn.neighbours[ik, ib]
-                ib_unique = mmn.ib_unique_map[ik, ib]
-                SHM = np.tensordot(SH, mmn.data[ik, ib], axes=((1,), (0,))).swapaxes(-1, -2)
-                SHRW = self.wannier_gauge(SHM, ik, iknb)
-                if phase is not None:
-                    SHRW = SHRW * phase[:, :, ib_unique, None]
-                SHRW = SHRW - SHW
-                SHR_q[ik, :, :, :, :] += 1.j * SHRW[:, :, None] * mmn.wk[ik, ib] * mmn.bk_cart[ik, ib, None, None, :, None]
-        return SHR_q
+                SH *= eig.data[sl, None, :, None]  # SH is a new array of the chunk
+            SHW = self._wannier_gauge_batched(SH, npar_k=npar_k, sl=sl)
+            SHM = einsum_kpool("kmlb,kiln->kimnb", SH, mmn.data[sl], npar_k=npar_k)
+            SHRW = self._wannier_gauge_batched(SHM, ik_ket=mmn.neighbours, npar_k=npar_k, sl=sl)
+            if phase_kb is not None:
+                SHRW = SHRW * phase_kb[sl, ..., None]
+            SHRW = SHRW - SHW[:, None]
+            return 1.j * np.einsum("kimnb,ki,kia->kmnab", SHRW, mmn.wk[sl], mmn.bk_cart[sl], optimize=True)
+
+        return self._by_spn_chunks(spn, chunk)
 
 
     @property
@@ -307,8 +534,8 @@ class CheckPoint_bare(CheckPoint):
         self.num_kpts = eig.NK
         self.num_wann = amn.NW
         self.num_bands = mmn.NB
-        self.win_min = np.array([0] * self.num_kpts)
-        self.win_max = np.array([self.num_bands] * self.num_kpts)
+        self.win_min = np.zeros(self.num_kpts, dtype=int)
+        self.win_max = np.full(self.num_kpts, self.num_bands)
         self.recip_lattice = 2 * np.pi * np.linalg.inv(self.real_lattice).T
 
 
@@ -328,6 +555,9 @@ class Wannier90data:
             write npz for all formatted files
         overwrite_npz : bool
             overwrite existing npz files  (incompatinble with read_npz)
+        npar_k : int
+            number of k-point pools, filled by parallel threads, when reading the uHu, uIu, sHu and sIu files
+            (see `~wannierberri.system.w90_files.map_kpool`)
      """
 
     # todo :  rotate uHu and spn
@@ -340,6 +570,7 @@ class Wannier90data:
                  write_npz_formatted=True,
                  overwrite_npz=False,
                  formatted=tuple(),
+                 npar_k=1,
                  ):  # ,sitesym=False):
         assert not (read_npz and overwrite_npz), "cannot read and overwrite npz files"
         self.seedname = copy(seedname)
@@ -361,6 +592,7 @@ class Wannier90data:
             self.write_npz_list.update(formatted)
             self.write_npz_list.update(['mmn', 'eig', 'amn'])
         self.formatted_list = formatted
+        self.npar_k = npar_k
         if read_chk:
             self.chk = CheckPoint(seedname, kmesh_tol=kmesh_tol, bk_complete_tol=bk_complete_tol)
             self.wannierised = True
@@ -399,6 +631,8 @@ class Wannier90data:
         kwargs = {}
         if key in ["uhu", "uiu", "shu", "siu"]:
             kwargs["formatted"] = key in self.formatted_list
+        if key in ["uhu", "uiu", "shu", "siu"]:
+            kwargs["npar_k"] = self.npar_k
         if key not in ["chk", "win"]:
             kwargs["read_npz"] = self.read_npz
             kwargs["write_npz"] = key in self.write_npz_list
@@ -500,20 +734,96 @@ class Wannier90data:
     # TODO : allow k-dependent window (can it be useful?)
 
 
+# arrays smaller than this are read into memory even with `mmap_mode`
+NPZ_MMAP_MIN_BYTES = 2 ** 20
+
+# the largest dense SPN matrix evaluated at once by the consumers (see :meth:`SPN.dense_chunks`)
+SPN_DENSE_CHUNK_BYTES = 2 ** 28
+
+
+def load_npz(f_npz, tags, mmap_mode=None):
+    """
+    read the arrays `tags` from an npz file
+
+    `np.load` ignores `mmap_mode` for npz files, therefore the members which are stored uncompressed
+    and are larger than `NPZ_MMAP_MIN_BYTES` are memory-mapped here directly from the
+    zip archive. Compressed and small members (e.g. `G`, `neighbours`) are read into memory.
+
+    Returns
+    -------
+    dict(str, array)
+    """
+    result = {}
+    with np.load(f_npz, allow_pickle=False) as dic:
+        if mmap_mode is None:
+            return {k: dic[k] for k in tags}
+        with zipfile.ZipFile(f_npz) as zf, open(f_npz, "rb") as f:
+            for k in tags:
+                info = zf.getinfo(k + ".npy")
+                if info.compress_type == zipfile.ZIP_STORED:
+                    # skip the local file header : 30 bytes, then the file name and the extra field
+                    f.seek(info.header_offset)
+                    len_name, len_extra = struct.unpack("<HH", f.read(30)[26:30])
+                    f.seek(info.header_offset + 30 + len_name + len_extra)
+                    version = np.lib.format.read_magic(f)
+                    if version == (1, 0):
+                        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                    else:
+                        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                    if np.prod(shape) * dtype.itemsize >= NPZ_MMAP_MIN_BYTES and not dtype.hasobject:
+                        result[k] = np.memmap(f_npz, dtype=dtype, mode=mmap_mode, shape=shape,
+                                              order="F" if fortran_order else "C", offset=f.tell())
+                        continue
+                result[k] = dic[k]
+    return result
+
+
 class W90_file(abc.ABC):
+    """
+    Abstract class for the files of wannier90
 
-    def __init__(self, seedname, ext, tags=["data"], read_npz=True, write_npz=True, **kwargs):
+    Parameters
+    ----------
+    seedname : str
+        the prefix of the file (including relative/absolute path, but not including the extensions)
+    ext : str
+        the extension of the file
+    tags : list(str)
+        the attributes which are stored in the npz file
+    read_npz : bool
+        if True, try to read the file converted to npz (e.g. `wannier90.mmn.npz`)
+    write_npz : bool
+        write the npz file after reading the wannier90 file
+    compress : bool
+        write a compressed npz file. The data are mostly incompressible complex numbers,
+        therefore by default the npz file is not compressed, which makes reading and writing much faster
+    mmap_mode : str or None
+        memory-map the large arrays of an uncompressed npz file (see :func:`load_npz`), so that
+        only the pages which are actually used are read from the disk. None - read everything into memory
+    """
+
+    def __init__(self, seedname, ext, tags=["data"], read_npz=True, write_npz=True, compress=False, mmap_mode='r',
+                 **kwargs):
         f_npz = f"{seedname}.{ext}.npz"
         print(f"calling w90 file with {seedname}, {ext}, tags={tags}, read_npz={read_npz}, write_npz={write_npz}, kwargs={kwargs}")
+        dic = None
         if os.path.exists(f_npz) and read_npz:
-            dic = np.load(f_npz)
+            try:
+                dic = load_npz(f_npz, tags, mmap_mode=mmap_mode)
+            except KeyError as err:
+                # e.g. written by an older version, which stored other arrays
+                print(f"could not read {tags} from {f_npz} : {err}, reading the wannier90 file instead")
+        if dic is not None:
             for k in tags:
                 self.__setattr__(k, dic[k])
         else:
             self.from_w90_file(seedname, **kwargs)
             dic = {k: self.__getattribute__(k) for k in tags}
             if write_npz:
-                np.savez_compressed(f_npz, **dic)
+                if compress:
+                    np.savez_compressed(f_npz, **dic)
+                else:
+                    np.savez(f_npz, **dic)
 
     @abc.abstractmethod
     def from_w90_file(self, **kwargs):
@@ -540,10 +850,6 @@ class W90_file(abc.ABC):
             return None
 
 
-def convert(A):
-    return np.array([l.split() for l in A], dtype=float)
-
-
 class MMN(W90_file):
     """
     MMN.data[ik, ib, m, n] = <u_{m,k}|u_{n,k+b}>
@@ -553,41 +859,25 @@ class MMN(W90_file):
     def n_neighb(self):
         return 1
 
-    def __init__(self, seedname, npar=multiprocessing.cpu_count(), **kwargs):
-        super().__init__(seedname, "mmn", tags=['data', 'G', 'neighbours'], npar=npar, **kwargs)
+    def __init__(self, seedname, npar=None, **kwargs):
+        # npar is not used anymore (the file is parsed by numpy), kept for compatibility
+        super().__init__(seedname, "mmn", tags=['data', 'G', 'neighbours'], **kwargs)
 
-    def from_w90_file(self, seedname, npar):
+    def from_w90_file(self, seedname):
         t0 = time()
-        f_mmn_in = open(seedname + ".mmn", "r")
-        f_mmn_in.readline()
-        NB, NK, NNB = np.array(f_mmn_in.readline().split(), dtype=int)
-        block = 1 + NB * NB
-        data = []
-        headstring = []
-        mult = 4
-
-        # FIXME: npar = 0 does not work
-        if npar > 0:
-            pool = multiprocessing.Pool(npar)
-        for j in range(0, NNB * NK, npar * mult):
-            x = list(islice(f_mmn_in, int(block * npar * mult)))
-            if len(x) == 0:
-                break
-            headstring += x[::block]
-            y = [x[i * block + 1:(i + 1) * block] for i in range(npar * mult) if (i + 1) * block <= len(x)]
-            if npar > 0:
-                data += pool.map(convert, y)
-            else:
-                data += [convert(z) for z in y]
-
-        if npar > 0:
-            pool.close()
-            pool.join()
-        f_mmn_in.close()
+        with open(seedname + ".mmn", "r") as f_mmn_in:
+            f_mmn_in.readline()
+            NB, NK, NNB = np.array(f_mmn_in.readline().split(), dtype=int)
+            # each block consists of a header line (5 integers) and NB*NB lines with real and imaginary parts
+            block = 5 + 2 * NB * NB
+            data = np.fromstring(f_mmn_in.read(), dtype=float, sep=" ", count=NK * NNB * block)
+        assert data.size == NK * NNB * block, f"{seedname}.mmn : expected {NK * NNB * block} numbers, read {data.size}"
+        data = data.reshape(NK * NNB, block)
         t1 = time()
-        data = [d[:, 0] + 1j * d[:, 1] for d in data]
-        self.data = np.array(data).reshape(NK, NNB, NB, NB).transpose((0, 1, 3, 2))
-        headstring = np.array([s.split() for s in headstring], dtype=int).reshape(NK, NNB, 5)
+        headstring = np.array(data[:, :5], dtype=int).reshape(NK, NNB, 5)
+        # materialize the transpose once here, rather than striding over it in every gauge transformation
+        self.data = np.ascontiguousarray(
+            np.ascontiguousarray(data[:, 5:]).view(complex).reshape(NK, NNB, NB, NB).transpose((0, 1, 3, 2)))
         assert np.all(headstring[:, :, 0] - 1 == np.arange(NK)[:, None])
         self.neighbours = headstring[:, :, 1] - 1
         self.G = headstring[:, :, 2:]
@@ -610,20 +900,23 @@ class MMN(W90_file):
                         for nbrs, G in zip(self.neighbours.T, self.G.transpose(1, 0, 2))
                     ]).transpose(1, 0, 2),
                 dtype=int)
-            bk_latt_unique = np.array([b for b in set(tuple(bk) for bk in bk_latt.reshape(-1, 3))], dtype=int)
+            # bk_latt_unique[ib_unique_map[ik, ib]] = bk_latt[ik, ib]
+            bk_latt_unique, ib_unique_map = np.unique(bk_latt.reshape(-1, 3), axis=0, return_inverse=True)
+            ib_unique_map = ib_unique_map.reshape(self.NK, self.NNB)
             assert len(bk_latt_unique) == self.NNB
             bk_cart_unique = bk_latt_unique.dot(recip_lattice / mp_grid[:, None])
             bk_cart_unique_length = np.linalg.norm(bk_cart_unique, axis=1)
+            # for the shells the b-vectors are sorted by length
             srt = np.argsort(bk_cart_unique_length)
-            bk_latt_unique = bk_latt_unique[srt]
-            bk_cart_unique = bk_cart_unique[srt]
-            bk_cart_unique_length = bk_cart_unique_length[srt]
+            bk_latt_srt = bk_latt_unique[srt]
+            bk_cart_srt = bk_cart_unique[srt]
+            bk_cart_srt_length = bk_cart_unique_length[srt]
             brd = [
                       0,
-                  ] + list(np.where(bk_cart_unique_length[1:] - bk_cart_unique_length[:-1] > kmesh_tol)[0] + 1) + [
+                  ] + list(np.where(bk_cart_srt_length[1:] - bk_cart_srt_length[:-1] > kmesh_tol)[0] + 1) + [
                       self.NNB,
                   ]
-            shell_mat = np.array([bk_cart_unique[b1:b2].T.dot(bk_cart_unique[b1:b2]) for b1, b2 in zip(brd, brd[1:])])
+            shell_mat = np.array([bk_cart_srt[b1:b2].T.dot(bk_cart_srt[b1:b2]) for b1, b2 in zip(brd, brd[1:])])
             shell_mat_line = shell_mat.reshape(-1, 9)
             u, s, v = np.linalg.svd(shell_mat_line, full_matrices=False)
             s = 1. / s
@@ -634,14 +927,14 @@ class MMN(W90_file):
                 raise RuntimeError(
                     f"Error while determining shell weights. the following matrix :\n {check_eye} \n"
                     f"failed to be identity by an error of {tol}. Further debug information :  \n"
-                    f"bk_latt_unique={bk_latt_unique} \n bk_cart_unique={bk_cart_unique} \n"
-                    f"bk_cart_unique_length={bk_cart_unique_length}\n shell_mat={shell_mat}\n"
+                    f"bk_latt_unique={bk_latt_srt} \n bk_cart_unique={bk_cart_srt} \n"
+                    f"bk_cart_unique_length={bk_cart_srt_length}\n shell_mat={shell_mat}\n"
                     f"weight_shell={weight_shell}\n")
-            weight = np.array([w for w, b1, b2 in zip(weight_shell, brd, brd[1:]) for i in range(b1, b2)])
-            weight_dict = {tuple(bk): w for bk, w in zip(bk_latt_unique, weight)}
-            bk_cart_dict = {tuple(bk): bkcart for bk, bkcart in zip(bk_latt_unique, bk_cart_unique)}
-            self.bk_cart = np.array([[bk_cart_dict[tuple(bkl)] for bkl in bklk] for bklk in bk_latt])
-            self.wk = np.array([[weight_dict[tuple(bkl)] for bkl in bklk] for bklk in bk_latt])
+            weight = np.zeros(self.NNB)
+            for w, b1, b2 in zip(weight_shell, brd, brd[1:]):
+                weight[srt[b1:b2]] = w
+            self.bk_cart = bk_cart_unique[ib_unique_map]
+            self.wk = weight[ib_unique_map]
 
             #############
             ### Oscar ###
@@ -655,19 +948,6 @@ class MMN(W90_file):
             # any pair {q,b} to a unique list of b vectors that is independent
             # of q.
 
-            bk_latt = np.rint((self.bk_cart @ np.linalg.inv(recip_lattice)) * mp_grid[None, None, :]).astype(int)
-            bk_latt_unique = np.unique(bk_latt.reshape(-1, 3), axis=0)
-            bk_cart_unique = (bk_latt_unique / mp_grid[None, :]) @ recip_lattice
-            assert bk_latt_unique.shape == (self.NNB, 3)
-
-            ib_unique_map = np.zeros((self.NK, self.NNB), dtype=int)
-            for ik in range(self.NK):
-                for ib in range(self.NNB):
-                    b_latt = np.rint((self.bk_cart[ik, ib, :] @ np.linalg.inv(recip_lattice)) * mp_grid).astype(int)
-                    ib_unique = [tuple(b) for b in bk_latt_unique].index(tuple(b_latt))
-                    assert np.allclose(bk_cart_unique[ib_unique, :], self.bk_cart[ik, ib, :])
-                    ib_unique_map[ik, ib] = ib_unique
-
             self.bk_latt_unique = bk_latt_unique
             self.bk_cart_unique = bk_cart_unique
             self.ib_unique_map = ib_unique_map
@@ -677,11 +957,6 @@ class MMN(W90_file):
         self.set_bk(chk.kpt_latt, chk.mp_grid, chk.recip_lattice, **argv)
 
 
-def str2arraymmn(A):
-    a = np.array([l.split()[3:] for l in A], dtype=float)
-    return (a[:, 0] + 1j * a[:, 1])
-
-
 class AMN(W90_file):
 
     @property
@@ -692,18 +967,22 @@ class AMN(W90_file):
     def NW(self):
         return self.data.shape[2]
 
-    def __init__(self, seedname, npar=multiprocessing.cpu_count(), **kwargs):
-        super().__init__(seedname, "amn", tags=['data'], npar=npar, **kwargs)
+    def __init__(self, seedname, npar=None, **kwargs):
+        # npar is not used anymore (the file is parsed by numpy), kept for compatibility
+        super().__init__(seedname, "amn", tags=['data'], **kwargs)
 
-    def from_w90_file(self, seedname, npar):
-        f_mmn_in = open(seedname + ".amn", "r").readlines()
-        print(f"reading {seedname}.amn: " + f_mmn_in[0].strip())
-        s = f_mmn_in[1]
-        NB, NK, NW = np.array(s.split(), dtype=int)
-        block = NW * NB
-        allmmn = (f_mmn_in[2 + j * block:2 + (j + 1) * block] for j in range(NK))
-        p = multiprocessing.Pool(npar)
-        self.data = np.array(p.map(str2arraymmn, allmmn)).reshape((NK, NW, NB)).transpose(0, 2, 1)
+    def from_w90_file(self, seedname):
+        with open(seedname + ".amn", "r") as f_amn_in:
+            print(f"reading {seedname}.amn: " + f_amn_in.readline().strip())
+            NB, NK, NW = np.array(f_amn_in.readline().split(), dtype=int)
+            # each line contains m, n, ik, and the real and imaginary parts
+            data = np.fromstring(f_amn_in.read(), dtype=float, sep=" ", count=NK * NW * NB * 5)
+        assert data.size == NK * NW * NB * 5, f"{seedname}.amn : expected {NK * NW * NB * 5} numbers, read {data.size}"
+        data = data.reshape(NK * NW * NB, 5)
+        # the (re, im) columns are reinterpreted as complex in one copy, the file order is [ik, iw, ib],
+        # and the transpose to [ik, ib, iw] only permutes the strides
+        data = np.ascontiguousarray(data[:, 3:5]).view(complex)
+        self.data = data.reshape((NK, NW, NB)).transpose(0, 2, 1)
 
     """
     def write(self,seedname,comment="written by WannierBerri"):
@@ -726,22 +1005,79 @@ class EIG(W90_file):
         super().__init__(seedname=seedname, ext="eig", **kwargs)
 
     def from_w90_file(self, seedname):
-        data = np.loadtxt(seedname + ".eig")
+        # each line is : band index, k-point index, energy
+        with open(seedname + ".eig", "r") as f:
+            data = np.fromstring(f.read(), dtype=float, sep=" ")
+        assert data.size % 3 == 0, f"{seedname}.eig : the number of values {data.size} is not a multiple of 3"
+        data = data.reshape(-1, 3)
         NB = int(round(data[:, 0].max()))
         NK = int(round(data[:, 1].max()))
         data = data.reshape(NK, NB, 3)
-        assert np.linalg.norm(data[:, :, 0] - 1 - np.arange(NB)[None, :]) < 1e-15
-        assert np.linalg.norm(data[:, :, 1] - 1 - np.arange(NK)[:, None]) < 1e-15
-        self.data = data[:, :, 2]
+        assert np.array_equal(data[:, :, 0], np.broadcast_to(1 + np.arange(NB)[None, :], (NK, NB)))
+        assert np.array_equal(data[:, :, 1], np.broadcast_to(1 + np.arange(NK)[:, None], (NK, NB)))
+        self.data = np.ascontiguousarray(data[:, :, 2])
 
 
 class SPN(W90_file):
     """
     SPN.data[ik, m, n, ipol] = <u_{m,k}|S_ipol|u_{n,k}>
+
+    Only the upper triangle is stored (as in the file, also in the npz file) :
+    SPN.packed[ik, ipair, ipol] = SPN.data[ik, n, m, ipol] for m, n = np.tril_indices(NB)[0][ipair], [1][ipair]
+    (see :func:`_tril_pair`).
+    The dense `data` is not stored, it is evaluated on every access (see :attr:`data`). The consumers
+    evaluate it for a chunk of k-points at a time (see :meth:`dense_chunks`)
     """
 
     def __init__(self, seedname, **kwargs):
-        super().__init__(seedname=seedname, ext="spn", **kwargs)
+        f_npz = f"{seedname}.spn.npz"
+        if kwargs.get("read_npz", True) and os.path.exists(f_npz):
+            with np.load(f_npz, allow_pickle=False) as dic:
+                dense_npz = "packed" not in dic.files and "data" in dic.files
+            if dense_npz:
+                # written by older versions, which stored the dense matrix
+                print(f"reading the dense SPN matrix from {f_npz}")
+                data = load_npz(f_npz, ["data"], mmap_mode=kwargs.get("mmap_mode", 'r'))["data"]
+                indm, indn, _ = _tril_pair(data.shape[1])
+                self.packed = np.ascontiguousarray(data[:, indn, indm, :])
+                return
+        super().__init__(seedname=seedname, ext="spn", tags=["packed"], **kwargs)
+
+    @property
+    def NK(self):
+        return self.packed.shape[0]
+
+    @property
+    def NB(self):
+        # npair = NB * (NB + 1) // 2
+        return (math.isqrt(8 * self.packed.shape[1] + 1) - 1) // 2
+
+    def get_dense(self, sl=slice(None)):
+        """the dense matrix elements `data[sl]` (a new array)"""
+        packed = self.packed[sl]
+        indm, indn, _ = _tril_pair(self.NB)
+        dense = np.empty((packed.shape[0], self.NB, self.NB, 3), dtype=complex)
+        _spn_fill(packed, indn, indm, dense)
+        return dense
+
+    @property
+    def data(self):
+        """
+        the dense matrix elements of all k-points. Every access builds a new array of shape (NK, NB, NB, 3)
+        from `packed`, i.e. O(NK*NB**2) work and memory : store the result if it is needed several times,
+        or use :meth:`dense_chunks`
+        """
+        return self.get_dense()
+
+    def dense_chunks(self):
+        """
+        yield `(sl, data[sl])` for the consecutive slices `sl` of the k-points, such that the dense
+        matrix of one chunk takes at most `SPN_DENSE_CHUNK_BYTES` (but at least one k-point)
+        """
+        nk_chunk = max(1, SPN_DENSE_CHUNK_BYTES // (self.NB ** 2 * 3 * 16))
+        for start in range(0, self.NK, nk_chunk):
+            sl = slice(start, min(start + nk_chunk, self.NK))
+            yield sl, self.get_dense(sl)
 
     def from_w90_file(self, seedname='wannier90', formatted=False):
         print("----------\n SPN  \n---------\n")
@@ -750,29 +1086,34 @@ class SPN(W90_file):
             SPNheader = f_spn_in.readline().strip()
             nbnd, NK = (int(x) for x in f_spn_in.readline().split())
         else:
-            f_spn_in = FortranFileR(seedname + ".spn")
+            try:
+                f_spn_in = FortranFileMmap(seedname + ".spn")
+            except ValueError:
+                f_spn_in = FortranFileR(seedname + ".spn")
             SPNheader = (f_spn_in.read_record(dtype='c'))
             nbnd, NK = f_spn_in.read_record(dtype=np.int32)
             SPNheader = "".join(a.decode('ascii') for a in SPNheader)
 
         print(f"reading {seedname}.spn : {SPNheader}")
 
-        indm, indn = np.tril_indices(nbnd)
-        self.data = np.zeros((NK, nbnd, nbnd, 3), dtype=complex)
-
-        for ik in range(NK):
-            A = np.zeros((3, nbnd, nbnd), dtype=complex)
-            if formatted:
-                tmp = np.array([f_spn_in.readline().split() for i in range(3 * nbnd * (nbnd + 1) // 2)], dtype=float)
-                tmp = tmp[:, 0] + 1.j * tmp[:, 1]
-            else:
-                tmp = f_spn_in.read_record(dtype=np.complex128)
-            A[:, indn, indm] = tmp.reshape(3, nbnd * (nbnd + 1) // 2, order='F')
-            check = np.einsum('ijj->', np.abs(A.imag))
-            A[:, indm, indn] = A[:, indn, indm].conj()
-            if check > 1e-10:
-                raise RuntimeError(f"REAL DIAG CHECK FAILED : {check}")
-            self.data[ik] = A.transpose(1, 2, 0)
+        # each record runs over (ipol, pair) with ipol fastest, i.e. it is a C-ordered (npair, 3) array
+        npair = nbnd * (nbnd + 1) // 2
+        if formatted:
+            tmp = np.fromstring(f_spn_in.read(), dtype=float, sep=" ", count=2 * 3 * npair * NK)
+            assert tmp.size == 2 * 3 * npair * NK, f"{seedname}.spn : expected {2 * 3 * npair * NK} numbers, read {tmp.size}"
+            self.packed = tmp.view(complex).reshape(NK, npair, 3)  # (re, im) pairs
+        elif isinstance(f_spn_in, FortranFileMmap):
+            # a read-only view of the file
+            self.packed = f_spn_in.read_records(np.complex128, NK).reshape(NK, npair, 3)
+        else:
+            self.packed = np.empty((NK, npair, 3), dtype=complex)
+            for ik in range(NK):
+                self.packed[ik] = f_spn_in.read_record(dtype=np.complex128).reshape(npair, 3)
+        f_spn_in.close()
+        diag = _tril_pair(nbnd)[2]
+        check = np.abs(self.packed[:, diag, :].imag).sum(axis=(1, 2)).max(initial=0)
+        if check > 1e-10:
+            raise RuntimeError(f"REAL DIAG CHECK FAILED : {check}")
         print("----------\n SPN OK  \n---------\n")
 
 
@@ -782,14 +1123,22 @@ class UXU(W90_file):
     pw2wannier90 writes data_pw2w90[n, m, ib1, ib2, ik] = <u_{m,k+b1}|X|u_{n,k+b2}>
     in column-major order. (X = H for UHU, X = I for UIU.)
     Here, we read to have data[ik, ib1, ib2, m, n] = <u_{m,k+b1}|X|u_{n,k+b2}>.
+
+    For a formatted file `data` is a view of the numbers in the order of the file (ib2 before ib1), with the b1/b2
+    axes swapped by the strides only; :meth:`CheckPoint.get_CCOOGG_qb` uses this order as it is, without a copy.
+
+    If `hermitian_b` is True, only the records with ib1 <= ib2 are used from an unformatted file,
+    the rest is set from data[ik, ib2, ib1] = data[ik, ib1, ib2].conj().T
     """
 
+    hermitian_b = False
+
     @property
     def n_neighb(self):
         return 2
 
 
-    def from_w90_file(self, seedname='wannier90', suffix='uXu', formatted=False):
+    def from_w90_file(self, seedname='wannier90', suffix='uXu', formatted=False, npar_k=1):
         print(f"----------\n  {suffix}   \n---------")
         print(f'formatted == {formatted}')
         if formatted:
@@ -797,23 +1146,54 @@ class UXU(W90_file):
             header = f_uXu_in.readline().strip()
             NB, NK, NNB = (int(x) for x in f_uXu_in.readline().split())
         else:
-            f_uXu_in = FortranFileR(seedname + "." + suffix)
+            try:
+                f_uXu_in = FortranFileMmap(seedname + "." + suffix)
+            except ValueError:
+                f_uXu_in = FortranFileR(seedname + "." + suffix)
             header = readstr(f_uXu_in)
             NB, NK, NNB = f_uXu_in.read_record('i4')
 
         print(f"reading {seedname}.{suffix} : <{header}>")
 
-        self.data = np.zeros((NK, NNB, NNB, NB, NB), dtype=complex)
+        # ib1 <= ib2 are read, ib1 < ib2 are mirrored
+        ib1_read, ib2_read = np.triu_indices(NNB)
+        ib1_upper, ib2_upper = np.triu_indices(NNB, k=1)
+
+        def mirror_b(sl):
+            self.data[sl, ib2_upper, ib1_upper] = self.data[sl, ib1_upper, ib2_upper].conj().swapaxes(-1, -2)
+
         if formatted:
-            tmp = np.array([f_uXu_in.readline().split() for i in range(NK * NNB * NNB * NB * NB)], dtype=float)
-            tmp_cplx = tmp[:, 0] + 1.j * tmp[:, 1]
+            nrows = NK * NNB * NNB * NB * NB
+            tmp = np.fromstring(f_uXu_in.read(), dtype=float, sep=" ", count=2 * nrows)
+            assert tmp.size == 2 * nrows, f"{seedname}.{suffix} : expected {2 * nrows} numbers, read {tmp.size}"
+            tmp_cplx = tmp.view(complex)  # (re, im) pairs
+            # file order [ik, ib2, ib1, m, n], the transpose only permutes the strides
             self.data = tmp_cplx.reshape(NK, NNB, NNB, NB, NB).transpose(0, 2, 1, 3, 4)
+        elif isinstance(f_uXu_in, FortranFileMmap):
+            # all the records at once, ordered as [ik, ib2, ib1], each record is (re, im)[n, m] in column-major order
+            tmp = f_uXu_in.read_records('f8', NK * NNB * NNB, prefetch=not self.hermitian_b)
+            tmp = tmp.view(complex).reshape(NK, NNB, NNB, NB, NB)
+            self.data = np.empty((NK, NNB, NNB, NB, NB), dtype=complex)
+
+            def fill(sl):
+                if self.hermitian_b:
+                    self.data[sl, ib1_read, ib2_read] = tmp[sl, ib2_read, ib1_read]
+                    mirror_b(sl)
+                else:
+                    self.data[sl] = tmp[sl].transpose(0, 2, 1, 3, 4)
+            map_kpool(fill, NK, npar_k)
         else:
+            self.data = np.zeros((NK, NNB, NNB, NB, NB), dtype=complex)
             for ik in range(NK):
                 for ib2 in range(NNB):
                     for ib1 in range(NNB):
-                        tmp = f_uXu_in.read_record('f8').reshape((2, NB, NB), order='F').transpose(2, 1, 0)
-                        self.data[ik, ib1, ib2] = tmp[:, :, 0] + 1j * tmp[:, :, 1]
+                        if self.hermitian_b and ib1 > ib2:
+                            f_uXu_in.skip_record()
+                            continue
+                        # (re, im)[n, m] in column-major order is complex[m, n] in row-major order
+                        self.data[ik, ib1, ib2] = f_uXu_in.read_record('f8').view(complex).reshape(NB, NB)
+            if self.hermitian_b:
+                map_kpool(mirror_b, NK, npar_k)
         print(f"----------\n {suffix} OK  \n---------\n")
         f_uXu_in.close()
 
@@ -832,6 +1212,8 @@ class UIU(UXU):
     UIU.data[ik, ib1, ib2, m, n] = <u_{m,k+b1}|u_{n,k+b2}>
     """
 
+    hermitian_b = True
+
     def __init__(self, seedname='wannier90', **kwargs):
         super().__init__(seedname=seedname, ext='uIu', suffix='uIu', **kwargs)
 
@@ -848,7 +1230,7 @@ class SXU(W90_file):
     def n_neighb(self):
         return 1
 
-    def from_w90_file(self, seedname='wannier90', formatted=False, suffix='sHu', **kwargs):
+    def from_w90_file(self, seedname='wannier90', formatted=False, suffix='sHu', npar_k=1, **kwargs):
         print(f"----------\n  {suffix}   \n---------")
 
         if formatted:
@@ -856,25 +1238,38 @@ class SXU(W90_file):
             header = f_sXu_in.readline().strip()
             NB, NK, NNB = (int(x) for x in f_sXu_in.readline().split())
         else:
-            f_sXu_in = FortranFileR(seedname + "." + suffix)
+            try:
+                f_sXu_in = FortranFileMmap(seedname + "." + suffix)
+            except ValueError:
+                f_sXu_in = FortranFileR(seedname + "." + suffix)
             header = readstr(f_sXu_in)
             NB, NK, NNB = f_sXu_in.read_record('i4')
 
         print(f"reading {seedname}.{suffix} : <{header}>")
 
-        self.data = np.zeros((NK, NNB, NB, NB, 3), dtype=complex)
-
         if formatted:
-            tmp = np.array([f_sXu_in.readline().split() for i in range(NK * NNB * 3 * NB * NB)], dtype=float)
-            tmp_cplx = tmp[:, 0] + 1j * tmp[:, 1]
+            nrows = NK * NNB * 3 * NB * NB
+            tmp = np.fromstring(f_sXu_in.read(), dtype=float, sep=" ", count=2 * nrows)
+            assert tmp.size == 2 * nrows, f"{seedname}.{suffix} : expected {2 * nrows} numbers, read {tmp.size}"
+            tmp_cplx = tmp.view(complex)  # (re, im) pairs
             self.data = tmp_cplx.reshape(NK, NNB, 3, NB, NB).transpose(0, 1, 3, 4, 2)
+        elif isinstance(f_sXu_in, FortranFileMmap):
+            # all the records at once, ordered as [ik, ib, ipol], each record is (re, im)[n, m] in column-major order
+            tmp = f_sXu_in.read_records('f8', NK * NNB * 3).view(complex).reshape(NK, NNB, 3, NB, NB)
+            self.data = np.empty((NK, NNB, NB, NB, 3), dtype=complex)
+
+            def fill(sl):
+                self.data[sl] = tmp[sl].transpose(0, 1, 3, 4, 2)
+            map_kpool(fill, NK, npar_k)
         else:
+            self.data = np.zeros((NK, NNB, NB, NB, 3), dtype=complex)
             for ik in range(NK):
                 for ib in range(NNB):
                     for ipol in range(3):
-                        tmp = f_sXu_in.read_record('f8').reshape((2, NB, NB), order='F').transpose(2, 1, 0)
+                        # (re, im)[n, m] in column-major order is complex[m, n] in row-major order
                         # tmp[m, n] = <u_{m,k}|S_ipol*X|u_{n,k+b}>
-                        self.data[ik, ib, :, :, ipol] = tmp[:, :, 0] + 1j * tmp[:, :, 1]
+                        tmp = f_sXu_in.read_record('f8').view(complex).reshape(NB, NB)
+                        self.data[ik, ib, :, :, ipol] = tmp
 
         print(f"----------\n {suffix} OK  \n---------\n")
         f_sXu_in.close()
@@ -899,7 +1294,8 @@ class SHU(SXU):
 
 
 def parse_win_raw(filename=None, text=None):
-    import wannier90io as w90io
+    if not W90IO_IMPORTED:
+        raise ImportError("reading the win file requires the `wannier90io` module")
     if filename is not None:
         with open(filename) as f:
             return w90io.parse_win_raw(f.read())
@@ -914,20 +1310,24 @@ class WIN():
         self.name = seedname + ".win"
         self.parsed = parse_win_raw(self.name)
         self.units_length = {'ang': 1., 'bohr': physical_constants['Bohr radius'][0] * 1e10}
+        # evaluated on the first call
+        self._unit_cell_cart_ang = None
+        self._kpoints = None
 
-    @functools.lru_cache()
     def get_param(self, param):
         return self.parsed['parameters'][param]
 
-    @functools.lru_cache()
     def get_unit_cell_cart_ang(self):
-        cell = self.parsed['unit_cell_cart']
-        A = np.array([cell['a1'], cell['a2'], cell['a3']])
-        return A * self.units_length[cell['units']]
+        if self._unit_cell_cart_ang is None:
+            cell = self.parsed['unit_cell_cart']
+            A = np.array([cell['a1'], cell['a2'], cell['a3']])
+            self._unit_cell_cart_ang = A * self.units_length[cell['units']]
+        return self._unit_cell_cart_ang
 
-    @functools.lru_cache()
     def get_kpoints(self):
-        return np.array(self.parsed['kpoints']['kpoints'])
+        if self._kpoints is None:
+            self._kpoints = np.array(self.parsed['kpoints']['kpoints'])
+        return self._kpoints
 
 
 """